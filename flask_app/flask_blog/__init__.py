@@ -2,9 +2,12 @@ from celery import Celery, Task
 from flask import Flask
 from flask_login import LoginManager
 
+from .client import service_client
 from .config import Config
+from .redis_ext import RedisStore
 
 login_manager = LoginManager()
+redis_store = RedisStore()
 
 
 def create_app(config_class=Config) -> Flask:
@@ -20,6 +23,15 @@ def create_app(config_class=Config) -> Flask:
     login_manager.login_view = 'auth.login'
     login_manager.login_message_category = 'info'
 
+    service_client.init_app(app)
+    redis_store.init_app(app)
+    from .user_cache import user_cache
+    user_cache.init_app(app)
+    from .fragments import fragment_cache
+    fragment_cache.init_app(app)
+    from .google_certs import google_certs
+    google_certs.init_app(app)
+
     from .main.routes import main_bp
     app.register_blueprint(main_bp)
     from .auth.routes import auth_bp
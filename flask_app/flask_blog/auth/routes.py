@@ -5,7 +5,7 @@ Flask authentication-related routes module.
 """
 
 import os
-from datetime import datetime
+from urllib.parse import quote_plus
 
 import flask_login
 import requests
@@ -13,13 +13,16 @@ from flask import (
     Blueprint, current_app, flash, redirect, render_template, request, url_for
 )
 from flask_login import current_user
-from google.auth.transport import requests as g_requests
-from google.oauth2 import id_token
 
 from . import forms
 from .utils import save_picture
+from ..client import service_client
+from ..google_certs import google_certs
 from ..models import User
-from ..utils import POST_SERVICE, USER_SERVICE, get_iter_pages, send_email
+from ..user_cache import user_cache
+from ..utils import (
+    POST_SERVICE, USER_SERVICE, get_page_context, render_page, send_email
+)
 
 # Create a user-related blueprint
 auth_bp = Blueprint(name='auth', import_name=__name__)
@@ -33,29 +36,25 @@ def user_posts(author: str):
     :return:
     """
     page = request.args.get('page', type=int, default=1)
-    r = requests.get(
-        f'{POST_SERVICE}/posts?author={author}&page={page}&per_page=5'
-    )
-    if r.status_code == 404:
+    after = request.args.get('after')
+    request_url = f'{POST_SERVICE}/posts?author={quote_plus(author)}'\
+        f'&page={page}&per_page=5'
+    if after is not None:  # Cursor mode, whose cost doesn't grow with depth
+        request_url += f'&after={quote_plus(after)}'
+    r = service_client.conditional_get(request_url)
+    if r.status_code != 200:
         flash(r.json()['message'], category='danger')
         return redirect(url_for('main.home'))
     paginated_data = r.json()
     posts_data = paginated_data['data']['posts']
-    for post in posts_data:
-        post['date_posted'] = datetime.fromisoformat(post['date_posted'])
-    pages = paginated_data['pagination_meta']['pages']
 
     context = {
         'author': paginated_data['data']['user_data'],
-        'p': {
-            'items': posts_data,
-            'page': page,
-            'pages': pages,
-            'total': paginated_data['pagination_meta']['total'],
-            'iter_pages': get_iter_pages(pages, page)
-        }
+        'p': get_page_context(
+            posts_data, paginated_data['pagination_meta'], page, author=author
+        )
     }
-    return render_template('user_posts.html', **context)
+    return render_page('user_posts.html', **context)
 
 
 @auth_bp.route('/register', methods=['GET', 'POST'])
@@ -71,7 +70,7 @@ def register():
 
     form = forms.RegistrationForm()
     if form.validate_on_submit():  # Successfully passed form validation
-        r = requests.post(
+        r = service_client.post(
             f'{USER_SERVICE}/users',
             json={
                 'username': form.username.data,
@@ -107,7 +106,7 @@ def login():
 
     form = forms.LoginForm()
     if form.validate_on_submit():  # Successfully passed form validation
-        r = requests.get(
+        r = service_client.get(
             f'{USER_SERVICE}/user-auth?email={form.email.data}',
             json={
                 'password': form.password.data
@@ -141,6 +140,7 @@ def _app_login(user_data: dict, remember: bool) -> None:
     """
     user = User().from_json(user_data)
     flask_login.login_user(user, remember=remember)
+    user_cache.store(user_data)  # Warm up the cache for the next requests
 
 
 @auth_bp.route('/google-login', methods=['POST'])
@@ -163,12 +163,10 @@ def google_login():
         'https://accounts.google.com'
     ]
 
-    # 1. Verifies and decrypts id_token with Google, to get the Google user
-    #    information
-    id_info = id_token.verify_oauth2_token(
-        id_token=request.json['id_token'],
-        request=g_requests.Request(),
-        audience=GOOGLE_APP_CLIENT_ID
+    # 1. Verifies and decrypts id_token with Google's certificates, to get the
+    #    Google user information
+    id_info = google_certs.verify_token(
+        request.json['id_token'], audience=GOOGLE_APP_CLIENT_ID
     )
     # Extra check: Check issuer (authorization server)
     if id_info['iss'] not in GOOGLE_AUTHORIZATION_SERVERS:
@@ -188,34 +186,25 @@ def google_login():
 def _oauth_local_login(oauth_username: str, email: str, image_url: str):
     """
     Private helper function to associate a local account with the given OAuth
-    user.
+    user, and log it in.
     :param oauth_username: str
     :param email: str
     :param image_url: str
     :return:
     """
-    pseudo_password = f'{oauth_username},{email}'
-    # Check whether this OAuth user exists
-    r = requests.get(f'{USER_SERVICE}/users/?email={email}')
-    if r.status_code == 404:  # Not existing
-        # Register the OAuth user
-        requests.post(
-            f'{USER_SERVICE}/users',
-            json={
-                'username': oauth_username,
-                'email': email,
-                'password': pseudo_password,
-                'from_oauth': True,
-                'image_url': image_url
-            }
-        )
-    # Log-in this OAuth user
-    r = requests.get(
-        f'{USER_SERVICE}/user-auth?email={email}',
+    # Register the OAuth user if not existing yet, and get it back, in a single
+    # call
+    r = service_client.post(
+        f'{USER_SERVICE}/oauth-users',
         json={
-            'password': pseudo_password
+            'username': oauth_username,
+            'email': email,
+            'image_url': image_url
         }
     )
+    if r.status_code not in (200, 201):
+        flash(r.json()['message'], category='danger')
+        return redirect(url_for('auth.login'))
     # Log-in on the main application side
     _app_login(user_data=r.json()['data'], remember=True)
     from_page = request.args.get('next')
@@ -314,15 +303,18 @@ def account():
             saved_filename = save_picture(form.username.data, form.picture.data)
             update['image_filename'] = saved_filename
         if update:
-            r = requests.put(
+            r = service_client.put(
                 f'{USER_SERVICE}/users/{current_user.id}', json=update
             )
             if r.status_code == 200:
+                user_cache.invalidate(current_user.id)
                 current_user.username = form.username.data
                 current_user.email = form.email.data
                 if form.picture.data:
                     current_user.image_filename = saved_filename
                 flash('Your account has been updated!', category='success')
+            else:
+                flash(r.json()['message'], category='danger')
             return redirect(url_for('auth.account'))
     elif request.method == 'GET':  # "GET" request
         # Populate the form with the current user's information
@@ -359,11 +351,13 @@ def follow_user(username: str):
     :param username: str
     :return:
     """
-    r = requests.post(
+    r = service_client.post(
         f'{USER_SERVICE}/user-follow/{current_user.id}/{username}'
     )
     if r.status_code == 201:
         followed_data = r.json()['data']
+        # Both users' follow counts have changed.
+        user_cache.invalidate(current_user.id, followed_data['id'])
         send_email(
             recipient=followed_data['email'],
             subject='Someone Followed You!',
@@ -383,10 +377,13 @@ def unfollow_user(username: str):
     :param username: str
     :return:
     """
-    r = requests.delete(
+    r = service_client.delete(
         f'{USER_SERVICE}/user-follow/{current_user.id}/{username}'
     )
-    if r.status_code == 204:
+    if r.status_code == 200:
+        unfollowed_data = r.json()['data']
+        # Both users' follow counts have changed.
+        user_cache.invalidate(current_user.id, unfollowed_data['id'])
         flash(f'You unfollowed {username}!', category='success')
     else:
         flash(r.json()['message'], category='danger')
@@ -0,0 +1,665 @@
+# -*- coding: utf-8 -*-
+
+"""
+Backend service client module.
+
+All the calls to the backend services go through the "service_client" below,
+which:
+- Keeps a pool of keep-alive connections to each backend service per worker,
+  shared by all the greenlets of the worker
+- Applies per-endpoint timeouts
+- Retries the failed idempotent calls within a retry budget, so that retries
+  can't multiply the load on a backend service which is already struggling
+- Records per-endpoint latency histograms
+- Protects the tail latency when a backend service slows down or fails:
+  - Adapts the read timeout of each endpoint to its recent latencies
+  - Hedges the idempotent GETs which take longer than usual, with a second
+    request, taking whichever answers first
+  Except for the CPU-bound endpoints, e.g., the password hashing ones, which
+  keep fixed timeouts, since a duplicate request would only add to the load.
+  - Fails fast with a circuit breaker per backend service, instead of letting
+    the greenlets pile up on a failing backend service
+The reads ask for MessagePack, which carries the datetimes natively.
+"""
+
+import copy
+import time
+from collections import defaultdict
+from datetime import datetime
+from typing import Optional, Union
+from urllib.parse import urlsplit
+
+import gevent
+import msgpack
+import requests
+from cachetools import LRUCache
+from flask import Flask
+from requests.adapters import HTTPAdapter
+
+# Upper bounds (in milliseconds) of the latency histogram buckets
+LATENCY_BUCKETS_MS = (5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000)
+
+IDEMPOTENT_METHODS = frozenset(['GET', 'HEAD', 'PUT', 'DELETE'])
+RETRY_STATUSES = frozenset([502, 503, 504])
+
+MSGPACK = 'application/msgpack'
+
+
+class DeadlineExceeded(requests.Timeout):
+    """
+    Raised for a call which hasn't been answered by its deadline.
+    """
+    pass
+
+
+class CircuitOpenError(requests.RequestException):
+    """
+    Raised instead of calling a backend service whose circuit breaker is open.
+    """
+    pass
+
+
+class ServiceResponse:
+    """
+    Response of a backend service call, which can be kept as a local copy.
+    "stale" tells a local copy served because the backend service failed.
+    """
+
+    def __init__(self, status_code: int, data, etag: Optional[str]=None,
+                 stale: bool=False):
+        self.status_code = status_code
+        self._data = data
+        self.etag = etag
+        self.stale = stale
+
+    def json(self):
+        """
+        Returns the decoded response body.
+        Since the callers may modify it in-place, it's a copy, so that the
+        local copy stays intact.
+        :return:
+        """
+        return copy.deepcopy(self._data)
+
+
+class RetryBudget:
+    """
+    Token bucket limiting the retries to a ratio of the calls.
+    Every call deposits "ratio" token, and every retry withdraws a whole token.
+    """
+
+    def __init__(self, ratio: float, max_tokens: float=10.0):
+        self.ratio = ratio
+        self.max_tokens = max_tokens
+        self._tokens = max_tokens
+
+    def deposit(self) -> None:
+        """
+        Deposits the tokens earned by a call.
+        :return: None
+        """
+        self._tokens = min(self._tokens + self.ratio, self.max_tokens)
+
+    def withdraw(self) -> bool:
+        """
+        Withdraws a token for a retry, if any is left.
+        :return: bool
+        """
+        if self._tokens < 1:
+            return False
+        self._tokens -= 1
+        return True
+
+
+class CircuitBreaker:
+    """
+    Circuit breaker of a backend service.
+    After "failure_threshold" consecutive failures, the circuit opens, and the
+    calls fail fast for "reset_timeout" seconds. Then it's half-open: a single
+    trial call is let through, which closes the circuit if it succeeds, or opens
+    it again otherwise.
+    """
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half-open'
+
+    def __init__(self, failure_threshold: int, reset_timeout: float):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = self.CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._trial_in_flight = False
+
+    def allow(self) -> bool:
+        """
+        Checks whether a call may go through.
+        :return: bool
+        """
+        if self.state == self.OPEN:
+            if time.monotonic() - self._opened_at < self.reset_timeout:
+                return False
+            self.state = self.HALF_OPEN
+            self._trial_in_flight = False
+        if self.state == self.HALF_OPEN:
+            if self._trial_in_flight:
+                return False
+            self._trial_in_flight = True
+        return True
+
+    def record_success(self) -> None:
+        """
+        Records a successful call.
+        :return: None
+        """
+        self.state = self.CLOSED
+        self._failures = 0
+        self._trial_in_flight = False
+
+    def record_failure(self) -> None:
+        """
+        Records a failed call.
+        :return: None
+        """
+        self._failures += 1
+        self._trial_in_flight = False
+        if self.state == self.HALF_OPEN or \
+                self._failures >= self.failure_threshold:
+            self.state = self.OPEN
+            self._opened_at = time.monotonic()
+
+    def release(self) -> None:
+        """
+        Gives up a call which was let through but ended without an outcome,
+        e.g., because it was cancelled, so that a half-open circuit lets the
+        next trial call through.
+        :return: None
+        """
+        self._trial_in_flight = False
+
+
+class AdaptiveTimeout:
+    """
+    Read timeout of an endpoint adapted to its recent latencies, the way TCP
+    adapts its retransmission timeout: the smoothed latency plus 4 times its
+    smoothed deviation, within [min_timeout, max_timeout].
+    """
+
+    def __init__(self, min_timeout: float, max_timeout: float):
+        self.min_timeout = min_timeout
+        self.max_timeout = max_timeout
+        self._latency = None
+        self._deviation = 0.0
+
+    def observe(self, latency: float) -> None:
+        """
+        Records the latency (in seconds) of a successful call.
+        :param latency: float
+        :return: None
+        """
+        if self._latency is None:
+            self._latency = latency
+            self._deviation = latency / 2
+        else:
+            self._deviation = \
+                0.75 * self._deviation + 0.25 * abs(self._latency - latency)
+            self._latency = 0.875 * self._latency + 0.125 * latency
+
+    def back_off(self) -> None:
+        """
+        Records a call which timed out, doubling the timeout, as TCP does, so
+        that the timeout catches up with a backend service which got slower.
+        :return: None
+        """
+        if self._latency is not None:
+            self._deviation = (2 * self.timeout - self._latency) / 4
+
+    @property
+    def timeout(self) -> float:
+        """
+        Current read timeout (in seconds).
+        :return: float
+        """
+        if self._latency is None:
+            return self.max_timeout
+        return min(
+            max(self._latency + 4 * self._deviation, self.min_timeout),
+            self.max_timeout
+        )
+
+    @property
+    def hedge_delay(self) -> Optional[float]:
+        """
+        Delay (in seconds) after which a call is slower than usual, and worth
+        hedging, or None if there are no latencies yet.
+        :return: float or None
+        """
+        if self._latency is None:
+            return None
+        return self._latency + 2 * self._deviation
+
+
+class LatencyHistogram:
+    """
+    Histogram of the call latencies of an endpoint, in LATENCY_BUCKETS_MS.
+    """
+
+    def __init__(self):
+        self.buckets = [0] * (len(LATENCY_BUCKETS_MS) + 1)  # The last one is +Inf
+        self.count = 0
+        self.errors = 0
+        self.sum_ms = 0.0
+
+    def observe(self, latency_ms: float, error: bool=False) -> None:
+        """
+        Records a call of the given latency.
+        :param latency_ms: float
+        :param error: bool
+        :return: None
+        """
+        i = 0
+        while i < len(LATENCY_BUCKETS_MS) and latency_ms > LATENCY_BUCKETS_MS[i]:
+            i += 1
+        self.buckets[i] += 1
+        self.count += 1
+        self.sum_ms += latency_ms
+        if error:
+            self.errors += 1
+
+    def to_dict(self) -> dict:
+        """
+        Returns this histogram as a dictionary.
+        :return: dict
+        """
+        bounds = [str(bound) for bound in LATENCY_BUCKETS_MS] + ['+Inf']
+        return {
+            'buckets': dict(zip(bounds, self.buckets)),
+            'count': self.count,
+            'errors': self.errors,
+            'mean_ms': self.sum_ms / self.count if self.count else 0.0
+        }
+
+
+class ServiceClient:
+    """
+    Pooled, keep-alive client of the backend services.
+    """
+
+    def __init__(self, app: Optional[Flask]=None):
+        self._session = None
+        self._default_timeout = None
+        self._timeouts = {}
+        self._fixed_timeout_endpoints = frozenset()
+        self._max_retries = 0
+        self._retry_ratio = 0.0
+        self._retry_budgets = {}
+        self._min_timeout = 0.0
+        self._adaptive_timeouts = {}
+        self._hedging = False
+        self._breaker_threshold = 0
+        self._breaker_reset_timeout = 0.0
+        self._breakers = {}
+        self._histograms = defaultdict(LatencyHistogram)
+        # Local copies of the GET responses tagged with an ETag, by URL, which
+        # are revalidated with "If-None-Match" rather than refetched
+        self._local_copies = LRUCache(maxsize=1024)
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app: Flask) -> None:
+        """
+        Initializes the connection pools with the given application's
+        configuration.
+        Since the application is created in each worker process, so are the
+        pools.
+        :param app: Flask
+        :return: None
+        """
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_maxsize=app.config['SERVICE_POOL_SIZE'])
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+        self._session = session
+        self._default_timeout = app.config['SERVICE_TIMEOUT']
+        self._timeouts = app.config['SERVICE_TIMEOUTS']
+        self._fixed_timeout_endpoints = \
+            app.config['SERVICE_FIXED_TIMEOUT_ENDPOINTS']
+        self._max_retries = app.config['SERVICE_MAX_RETRIES']
+        self._retry_ratio = app.config['SERVICE_RETRY_RATIO']
+        self._min_timeout = app.config['SERVICE_MIN_TIMEOUT']
+        self._hedging = app.config['SERVICE_HEDGING']
+        self._breaker_threshold = app.config['SERVICE_BREAKER_THRESHOLD']
+        self._breaker_reset_timeout = \
+            app.config['SERVICE_BREAKER_RESET_TIMEOUT']
+
+    def request(self, method: str, url: str, deadline: Optional[float]=None,
+                **kwargs) -> requests.Response:
+        """
+        Sends a request to a backend service.
+        If a deadline is given, every attempt's timeouts are capped by the time
+        left, and no attempt starts after it.
+        :param method: str
+        :param url: str
+        :param deadline: float or None, in time.monotonic() seconds
+        :param kwargs: the keyword arguments of requests.Session.request()
+        :return: requests.Response
+        :raises CircuitOpenError: if the circuit breaker of the backend service
+                                  is open
+        :raises DeadlineExceeded: if the deadline passed before an answer
+        :raises requests.RequestException: if the call failed and can't be
+                                           retried any more
+        """
+        method = method.upper()
+        endpoint = _get_endpoint(method, url)
+        service = urlsplit(url).netloc
+        connect_timeout, max_read_timeout = \
+            self._timeouts.get(endpoint, self._default_timeout)
+        fixed_timeout = endpoint in self._fixed_timeout_endpoints
+        adaptive_timeout = None
+        if not fixed_timeout:
+            adaptive_timeout = self._adaptive_timeouts.get(endpoint)
+            if adaptive_timeout is None:
+                adaptive_timeout = self._adaptive_timeouts[endpoint] = \
+                    AdaptiveTimeout(self._min_timeout, max_read_timeout)
+        breaker = self._get_breaker(service)
+        budget = self._get_retry_budget(service)
+        budget.deposit()
+        timeout = kwargs.pop('timeout', None)
+        if timeout is None:
+            timeout = (
+                connect_timeout,
+                max_read_timeout if fixed_timeout else adaptive_timeout.timeout
+            )
+        elif not isinstance(timeout, tuple):
+            timeout = (timeout, timeout)
+
+        attempt = 0
+        while True:
+            attempt_timeout = timeout
+            if deadline is not None:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise DeadlineExceeded(
+                        f'Deadline exceeded calling {endpoint}'
+                    )
+                attempt_timeout = tuple(min(t, remaining) for t in timeout)
+            if not breaker.allow():
+                raise CircuitOpenError(f'Circuit breaker of {service} is open')
+            hedge_delay = None
+            if self._hedging and method == 'GET' and not fixed_timeout:
+                hedge_delay = adaptive_timeout.hedge_delay
+            start = time.perf_counter()
+            try:
+                r = self._send(
+                    method, url, hedge_delay, budget, timeout=attempt_timeout,
+                    **kwargs
+                )
+            except requests.RequestException as e:
+                self._observe(endpoint, start, error=True)
+                breaker.record_failure()
+                if isinstance(e, requests.ReadTimeout) and not fixed_timeout:
+                    adaptive_timeout.back_off()
+                # A connect timeout means that the request has never been sent.
+                retryable = isinstance(e, requests.ConnectTimeout) or (
+                    method in IDEMPOTENT_METHODS and not (
+                        fixed_timeout and isinstance(e, requests.ReadTimeout)
+                    )
+                )
+                if not (retryable and
+                        self._may_retry(attempt, budget, deadline)):
+                    if isinstance(e, requests.Timeout) and \
+                            deadline is not None and \
+                            time.monotonic() >= deadline:
+                        raise DeadlineExceeded(
+                            f'Deadline exceeded calling {endpoint}'
+                        ) from e
+                    raise
+            except BaseException:  # Cancelled, e.g., killed by a deadline
+                breaker.release()
+                raise
+            else:
+                self._observe(endpoint, start, error=r.status_code >= 500)
+                if r.status_code >= 500:
+                    breaker.record_failure()
+                else:
+                    breaker.record_success()
+                    if not fixed_timeout:
+                        adaptive_timeout.observe(time.perf_counter() - start)
+                if not (r.status_code in RETRY_STATUSES and
+                        method in IDEMPOTENT_METHODS and
+                        self._may_retry(attempt, budget, deadline)):
+                    return r
+            attempt += 1
+            time.sleep(_backoff(attempt))  # Cooperative under gevent
+
+    def _send(self, method: str, url: str, hedge_delay: Optional[float],
+              budget: RetryBudget, **kwargs) -> requests.Response:
+        """
+        Private helper method to send a request, hedging it with a second one
+        if it hasn't answered within the given delay, as long as the retry
+        budget allows it; the first successful answer wins, where a server
+        error doesn't count as one.
+        If cancelled, the requests in flight are cancelled as well.
+        :param method: str
+        :param url: str
+        :param hedge_delay: float or None
+        :param budget: RetryBudget
+        :param kwargs: the keyword arguments of requests.Session.request()
+        :return: requests.Response
+        """
+        if hedge_delay is None:
+            return self._session.request(method, url, **kwargs)
+
+        primary = gevent.spawn(self._session.request, method, url, **kwargs)
+        greenlets = [primary]
+        try:
+            primary.join(timeout=hedge_delay)
+            if primary.ready() or not budget.withdraw():
+                return primary.get()
+            greenlets.append(
+                gevent.spawn(self._session.request, method, url, **kwargs)
+            )
+            while True:
+                finished = gevent.wait(greenlets, count=1)[0]
+                greenlets.remove(finished)
+                if (finished.successful() and
+                        finished.value.status_code < 500) or not greenlets:
+                    return finished.get()
+        finally:
+            for greenlet in greenlets:  # The slower one, or all if cancelled
+                greenlet.kill(block=False)
+
+    def get(self, url: str, **kwargs) -> requests.Response:
+        return self.request('GET', url, **kwargs)
+
+    def post(self, url: str, **kwargs) -> requests.Response:
+        return self.request('POST', url, **kwargs)
+
+    def put(self, url: str, **kwargs) -> requests.Response:
+        return self.request('PUT', url, **kwargs)
+
+    def delete(self, url: str, **kwargs) -> requests.Response:
+        return self.request('DELETE', url, **kwargs)
+
+    def conditional_get(self, url: str, stale_if_error: bool=False,
+                        deadline: Optional[float]=None) -> ServiceResponse:
+        """
+        Sends a GET request to the given URL, revalidating the local copy of
+        its response if any, so that an unchanged resource is neither
+        re-serialized by the backend service nor re-sent.
+        :param url: str
+        :param stale_if_error: bool, whether to fall back to the local copy,
+                               marked as stale, if the call fails, e.g.,
+                               because the circuit breaker is open
+        :param deadline: float or None, in time.monotonic() seconds; check out
+                         request()
+        :return: ServiceResponse
+        """
+        local_copy = self._local_copies.get(url)
+        headers = {
+            'Accept': f'{MSGPACK}, application/json;q=0.9'
+        }
+        if local_copy:
+            headers['If-None-Match'] = local_copy.etag
+
+        try:
+            r = self.get(url, headers=headers, deadline=deadline)
+        except requests.RequestException:
+            if not (stale_if_error and local_copy):
+                raise
+            return ServiceResponse(
+                local_copy.status_code, local_copy._data, local_copy.etag,
+                stale=True
+            )
+        if stale_if_error and r.status_code >= 500 and local_copy:
+            return ServiceResponse(
+                local_copy.status_code, local_copy._data, local_copy.etag,
+                stale=True
+            )
+        if r.status_code == 304 and local_copy:
+            return local_copy
+
+        response = ServiceResponse(
+            r.status_code, _decode_body(r), r.headers.get('ETag')
+        )
+        if r.status_code == 200 and response.etag:
+            self._local_copies[url] = response
+        else:
+            self._local_copies.pop(url, None)
+        return response
+
+    def get_stats(self) -> dict:
+        """
+        Returns the statistics of the calls of this worker: the latency
+        histograms and current read timeouts by endpoint, and the circuit
+        breaker states by backend service.
+        :return: dict
+        """
+        return {
+            'latencies': {
+                endpoint: histogram.to_dict()
+                for endpoint, histogram in sorted(self._histograms.items())
+            },
+            'read_timeouts': {
+                endpoint: adaptive_timeout.timeout
+                for endpoint, adaptive_timeout
+                in sorted(self._adaptive_timeouts.items())
+            },
+            'circuit_breakers': {
+                service: breaker.state
+                for service, breaker in sorted(self._breakers.items())
+            }
+        }
+
+    def _get_breaker(self, service: str) -> CircuitBreaker:
+        """
+        Private helper function to get the circuit breaker of the given backend
+        service.
+        :param service: str
+        :return: CircuitBreaker
+        """
+        breaker = self._breakers.get(service)
+        if breaker is None:
+            breaker = self._breakers[service] = CircuitBreaker(
+                self._breaker_threshold, self._breaker_reset_timeout
+            )
+        return breaker
+
+    def _get_retry_budget(self, service: str) -> RetryBudget:
+        """
+        Private helper function to get the retry budget of the given backend
+        service.
+        :param service: str
+        :return: RetryBudget
+        """
+        budget = self._retry_budgets.get(service)
+        if budget is None:
+            budget = self._retry_budgets[service] = RetryBudget(
+                self._retry_ratio
+            )
+        return budget
+
+    def _may_retry(self, attempt: int, budget: RetryBudget,
+                   deadline: Optional[float]=None) -> bool:
+        """
+        Private helper function to check whether a call may be retried after
+        the given number of retries, i.e., whether retries are left, the retry
+        budget allows it, and the backoff ends before the given deadline.
+        :param attempt: int
+        :param budget: RetryBudget
+        :param deadline: float or None
+        :return: bool
+        """
+        if attempt >= self._max_retries:
+            return False
+        if deadline is not None and \
+                time.monotonic() + _backoff(attempt + 1) >= deadline:
+            return False
+        return budget.withdraw()
+
+    def _observe(self, endpoint: str, start: float, error: bool) -> None:
+        """
+        Private helper function to record a call of the given endpoint,
+        started at the given time.
+        :param endpoint: str
+        :param start: float
+        :param error: bool
+        :return: None
+        """
+        self._histograms[endpoint].observe(
+            (time.perf_counter() - start) * 1000, error=error
+        )
+
+
+def _decode_body(r: requests.Response):
+    """
+    Private helper function to decode the body of the given response, in
+    MessagePack or JSON depending on its content type.
+    :param r: requests.Response
+    :return:
+    """
+    if not r.content:
+        return None
+    if r.headers.get('Content-Type', '').startswith(MSGPACK):
+        # Decode the timestamps into (UTC) datetimes
+        return msgpack.unpackb(r.content, raw=False, timestamp=3)
+    return r.json()
+
+
+def parse_datetime(value: Union[str, datetime]) -> datetime:
+    """
+    Gets the datetime from the given value of a service response, which is a
+    native timestamp in MessagePack, but an ISO 8601 string in JSON.
+    :param value: str or datetime
+    :return: datetime
+    """
+    if isinstance(value, datetime):
+        return value
+    return datetime.fromisoformat(value)
+
+
+def _backoff(attempt: int) -> float:
+    """
+    Private helper function to get the delay (in seconds) before the given
+    retry.
+    :param attempt: int
+    :return: float
+    """
+    return 0.05 * 2 ** attempt
+
+
+def _get_endpoint(method: str, url: str) -> str:
+    """
+    Private helper function to get the endpoint name of the given call, which
+    is the method with the service and the top-level resource, e.g.,
+    "GET post_service/posts".
+    :param method: str
+    :param url: str
+    :return: str
+    """
+    parts = urlsplit(url)
+    resource = parts.path.strip('/').split('/')[0]
+    return f'{method} {parts.hostname}/{resource}'
+
+
+service_client = ServiceClient()
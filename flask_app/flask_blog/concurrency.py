@@ -0,0 +1,67 @@
+# -*- coding: utf-8 -*-
+
+"""
+Concurrency utilities module, for the views which need several independent
+backend service calls.
+Since the application runs in gevent workers, the calls are issued in
+greenlets, so that the page waits for the slowest call, rather than for all of
+them one after another.
+"""
+
+import time
+from typing import Any, Callable, Dict
+
+import gevent
+from flask import copy_current_request_context, has_request_context
+
+from .client import DeadlineExceeded
+
+# Time (in seconds) given to the calls after the deadline to notice it, e.g.,
+# for a socket timeout to fire
+DEADLINE_GRACE = 0.1
+
+
+def gather(calls: Dict[str, Callable], timeout: float,
+           raise_errors: bool=True) -> Dict[str, Any]:
+    """
+    Runs the given independent calls concurrently, with a shared deadline, and
+    collects their results by name.
+    Each call is given the deadline as its "deadline" keyword argument, in
+    time.monotonic() seconds, e.g., for ServiceClient.request(), which caps
+    the timeouts and retries of its attempts by the time left, so that the
+    calls end by the deadline on their own, rather than being killed halfway.
+    :param calls: dict{str: Callable}, the calls by name, taking a "deadline"
+                  keyword argument, e.g.,
+                  functools.partial(service_client.get, url)
+    :param timeout: float, the shared deadline (in seconds) from now
+    :param raise_errors: bool, whether to raise the first error (in the order
+                         of the given calls), or to return the errors as the
+                         results of the failed calls
+    :return: dict{str: object}
+    :raises DeadlineExceeded: if a call didn't finish in time and raise_errors
+    """
+    deadline = time.monotonic() + timeout
+    greenlets = {}
+    for name, call in calls.items():
+        if has_request_context():  # Let the calls access the current request
+            call = copy_current_request_context(call)
+        greenlets[name] = gevent.spawn(call, deadline=deadline)
+    gevent.joinall(list(greenlets.values()), timeout=timeout + DEADLINE_GRACE)
+
+    results = {}
+    for name, greenlet in greenlets.items():
+        if not greenlet.ready():
+            # Not a deadline-aware call; it can't be stopped safely halfway,
+            # so it's left to finish.
+            results[name] = DeadlineExceeded(
+                f'"{name}" did not finish within {timeout}s'
+            )
+        elif greenlet.successful():
+            results[name] = greenlet.value
+        else:
+            results[name] = greenlet.exception
+    if raise_errors:
+        for result in results.values():
+            if isinstance(result, Exception):
+                raise result
+    return results
@@ -23,6 +23,77 @@ class Config:
     SQLALCHEMY_DATABASE_URI = f'postgres://{POSTGRES_USER}:{POSTGRES_PASSWORD}@{POSTGRES_HOSTNAME}/{POSTGRES_DB}'
     SQLALCHEMY_TRACK_MODIFICATIONS = False
 
+    # Backend service client
+    # Keep-alive connections kept per backend service, per worker
+    SERVICE_POOL_SIZE = int(os.environ.get('SERVICE_POOL_SIZE', 100))
+    # Default (connect, read) timeouts (in seconds), and those of the endpoints
+    # which need other ones, by "<METHOD> <service>/<resource>"
+    SERVICE_TIMEOUT = (1.0, 5.0)
+    SERVICE_TIMEOUTS = {
+        'GET user_service/user-auth': (1.0, 10.0),  # Password hashing
+        'POST user_service/users': (1.0, 10.0)  # Password hashing
+    }
+    # Endpoints which are CPU-bound in the backend service, whose latencies
+    # spike under load; they keep the fixed read timeouts above, and are
+    # neither hedged nor retried after a read timeout, which would only
+    # duplicate the work when the backend service is saturated
+    SERVICE_FIXED_TIMEOUT_ENDPOINTS = frozenset([
+        'GET user_service/user-auth',
+        'POST user_service/users'
+    ])
+    # Retries of a failed idempotent call, limited to the given ratio of all
+    # the calls per backend service
+    SERVICE_MAX_RETRIES = int(os.environ.get('SERVICE_MAX_RETRIES', 2))
+    SERVICE_RETRY_RATIO = float(os.environ.get('SERVICE_RETRY_RATIO', 0.1))
+    # The read timeouts above are the maximum ones; the actual ones adapt to
+    # the recent latencies of each endpoint, down to this minimum.
+    SERVICE_MIN_TIMEOUT = float(os.environ.get('SERVICE_MIN_TIMEOUT', 0.25))
+    # Whether to hedge the GETs slower than usual with a second request, within
+    # the retry budget
+    SERVICE_HEDGING = os.environ.get('SERVICE_HEDGING', 'true').lower() == 'true'
+    # Consecutive failures opening the circuit breaker of a backend service,
+    # and the time (in seconds) before a trial call is let through
+    SERVICE_BREAKER_THRESHOLD = int(
+        os.environ.get('SERVICE_BREAKER_THRESHOLD', 5)
+    )
+    SERVICE_BREAKER_RESET_TIMEOUT = float(
+        os.environ.get('SERVICE_BREAKER_RESET_TIMEOUT', 10)
+    )
+
+    # Redis, shared with the Celery broker on another database
+    REDIS_URL = os.environ.get('REDIS_URL', 'redis://redis:6379/3')
+
+    # Logged-in user snapshot cache: TTL (in seconds) of the snapshots in
+    # Redis, and size and TTL of the per-worker cache in front of it, which
+    # bounds how long the other workers may serve a stale snapshot
+    USER_CACHE_TTL = int(os.environ.get('USER_CACHE_TTL', 300))
+    USER_CACHE_LOCAL_SIZE = int(os.environ.get('USER_CACHE_LOCAL_SIZE', 1024))
+    USER_CACHE_LOCAL_TTL = float(os.environ.get('USER_CACHE_LOCAL_TTL', 5))
+
+    # Rendered-fragment cache: TTL (in seconds) of the fragments in Redis, and
+    # number of fragments kept per worker in front of it
+    FRAGMENT_CACHE_TTL = int(os.environ.get('FRAGMENT_CACHE_TTL', 3600))
+    FRAGMENT_CACHE_LOCAL_SIZE = int(
+        os.environ.get('FRAGMENT_CACHE_LOCAL_SIZE', 2048)
+    )
+
+    # Whether to stream the long list pages, and the number of template events
+    # per streamed chunk. Off by default: the backend calls are made before the
+    # streaming starts, so it only overlaps the rendering with the sending,
+    # while an error halfway through becomes a truncated 200.
+    STREAM_PAGES = os.environ.get('STREAM_PAGES', 'false').lower() == 'true'
+    STREAM_BUFFER_SIZE = int(os.environ.get('STREAM_BUFFER_SIZE', 20))
+
+    # Google's signing certificates for the ID tokens of the Google users, kept
+    # for their "Cache-Control: max-age" (or the default one, in seconds), and
+    # refreshed in the background this many seconds before they expire
+    GOOGLE_CERTS_URL = os.environ.get(
+        'GOOGLE_CERTS_URL', 'https://www.googleapis.com/oauth2/v1/certs'
+    )
+    GOOGLE_CERTS_DEFAULT_MAX_AGE = 3600
+    GOOGLE_CERTS_REFRESH_MARGIN = 300
+    GOOGLE_CERTS_FETCH_TIMEOUT = 5.0
+
 
 class CeleryFlaskConfig:
     SECRET_KEY = os.environ['FLASK_SECRET_KEY']
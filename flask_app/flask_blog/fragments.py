@@ -0,0 +1,119 @@
+# -*- coding: utf-8 -*-
+
+"""
+Rendered-fragment cache module.
+
+The rendered HTML of each post in the lists of posts only depends on the post
+and its author, so it's cached under a key made of their IDs and versions, and
+shared by all the users and pages.
+Since a change to the post or its author changes the key, a cached fragment
+never needs to be invalidated; the unreachable ones expire by TTL, or get
+evicted by the LRU policy of Redis under memory pressure.
+In front of Redis, each worker keeps its hottest fragments in a bounded LRU.
+"""
+
+from typing import Iterator, List
+
+from cachetools import LRUCache
+from flask import Flask, current_app, render_template
+from markupsafe import Markup
+from redis import RedisError
+
+from . import redis_store
+from .client import parse_datetime
+
+POST_SUMMARY_KEY = 'fragment:post_summary:{id}:{version}:{author_id}:{author_version}:{comment_count}'
+
+
+class FragmentCache:
+    """
+    Two-tier cache of the rendered post fragments.
+    """
+
+    def __init__(self):
+        self._local_fragments = None
+
+    def init_app(self, app: Flask) -> None:
+        """
+        Initializes the per-worker tier with the given application's
+        configuration.
+        :param app: Flask
+        :return: None
+        """
+        self._local_fragments = LRUCache(
+            maxsize=app.config['FRAGMENT_CACHE_LOCAL_SIZE']
+        )
+
+    def iter_post_summaries(self, posts_data: List[dict],
+                            batch_size: int=5) -> Iterator[Markup]:
+        """
+        Lazily renders the given posts in batches of the given size, so that a
+        streamed page can send the first posts before rendering the others.
+        :param posts_data: list[dict]
+        :param batch_size: int
+        :return: iterator[Markup]
+        """
+        for i in range(0, len(posts_data), batch_size):
+            yield from self.render_post_summaries(posts_data[i:i + batch_size])
+
+    def render_post_summaries(self, posts_data: List[dict]) -> List[Markup]:
+        """
+        Renders the given posts with "partials/post_summary.html", reusing the
+        cached fragments, and rendering and caching the missing ones only.
+        :param posts_data: list[dict]
+        :return: list[Markup]
+        """
+        keys = [_get_post_summary_key(post) for post in posts_data]
+        fragments = [self._local_fragments.get(key) for key in keys]
+        missing = [i for i, fragment in enumerate(fragments) if fragment is None]
+        if not missing:
+            return fragments
+
+        try:
+            cached = redis_store.mget([keys[i] for i in missing])
+        except RedisError:
+            current_app.logger.exception('Fragment cache unavailable')
+            cached = [None] * len(missing)
+        rendered = {}
+        for i, fragment in zip(missing, cached):
+            if fragment is None:
+                post = posts_data[i]
+                # Only parsed for the fragments to render
+                post['date_posted'] = parse_datetime(post['date_posted'])
+                fragment = render_template(
+                    'partials/post_summary.html', post=post
+                )
+                rendered[keys[i]] = fragment
+            fragment = Markup(fragment)
+            fragments[i] = self._local_fragments[keys[i]] = fragment
+
+        if rendered:
+            pipe = redis_store.pipeline(transaction=False)
+            for key, fragment in rendered.items():
+                pipe.set(
+                    key, fragment, ex=current_app.config['FRAGMENT_CACHE_TTL']
+                )
+            try:
+                pipe.execute()
+            except RedisError:
+                current_app.logger.exception('Fragment cache unavailable')
+        return fragments
+
+
+def _get_post_summary_key(post: dict) -> str:
+    """
+    Private helper function to get the cache key of the rendered summary of
+    the given post.
+    :param post: dict
+    :return: str
+    """
+    return POST_SUMMARY_KEY.format(
+        id=post['id'],
+        version=post['version'],
+        author_id=post['author']['id'],
+        author_version=post['author']['version'],
+        comment_count=post['comment_count']
+    )
+
+
+fragment_cache = FragmentCache()
@@ -0,0 +1,182 @@
+# -*- coding: utf-8 -*-
+
+"""
+Google signing certificates cache module, for verifying the ID tokens of the
+Google users.
+
+Rather than fetching Google's public certificates on every sign-in, they're
+kept per process for as long as Google's "Cache-Control: max-age" allows, and
+refreshed by a background greenlet shortly before they expire. If a refresh
+fails, the last-known certificates keep being served.
+The certificates URL is configurable by "GOOGLE_CERTS_URL", e.g., to point at a
+local stand-in endpoint in tests.
+"""
+
+import re
+import time
+from typing import Dict
+
+import gevent
+import requests
+from flask import Flask, current_app
+from google.auth import jwt
+
+_MAX_AGE_PATTERN = re.compile(r'max-age=(\d+)')
+
+# Minimum interval (in seconds) between the refreshes triggered by tokens
+# signed by unknown keys, so that bogus tokens can't make us refetch all the
+# time
+MIN_REFETCH_INTERVAL = 60
+
+
+class GoogleCertsCache:
+    """
+    Process-wide cache of Google's signing certificates.
+    """
+
+    def __init__(self):
+        self._url = None
+        self._refresh_margin = 0.0
+        self._default_max_age = 0
+        self._fetch_timeout = 0.0
+        self._certs = None
+        self._fetched_at = 0.0
+        self._expires_at = 0.0
+        self._refreshing = None  # The greenlet refreshing the certificates
+
+    def init_app(self, app: Flask) -> None:
+        """
+        Initializes the cache with the given application's configuration.
+        :param app: Flask
+        :return: None
+        """
+        self._url = app.config['GOOGLE_CERTS_URL']
+        self._refresh_margin = app.config['GOOGLE_CERTS_REFRESH_MARGIN']
+        self._default_max_age = app.config['GOOGLE_CERTS_DEFAULT_MAX_AGE']
+        self._fetch_timeout = app.config['GOOGLE_CERTS_FETCH_TIMEOUT']
+
+    def get_certs(self) -> Dict[str, str]:
+        """
+        Gets the current certificates, by key ID.
+        Only blocks when there are no certificates yet; otherwise, the ones
+        about to expire are refreshed in the background.
+        :return: dict{str: str}
+        :raises requests.RequestException: if there are no certificates yet,
+                                           and they can't be fetched
+        """
+        if self._certs is None:
+            self.refresh()
+        elif time.monotonic() >= self._expires_at - self._refresh_margin:
+            self._refresh_in_background()
+        return self._certs
+
+    def refresh(self) -> None:
+        """
+        Fetches the certificates, or waits for the refresh in progress if any,
+        so that the concurrent callers, e.g., the sign-ins on a cold start,
+        share a single fetch.
+        :return: None
+        :raises requests.RequestException: if the certificates can't be fetched
+        """
+        if self._refreshing is not None:
+            self._refreshing.join()
+            if self._certs is not None:
+                return
+        if self._refreshing is None:
+            self._refreshing = gevent.spawn(self._fetch_as_refresh)
+        self._refreshing.get()
+
+    def verify_token(self, token: str, audience: str) -> dict:
+        """
+        Verifies the given Google ID token against the cached certificates,
+        and returns its claims.
+        A token signed by a key unknown to the cached certificates, e.g., just
+        after Google rotated its keys, triggers one refresh, at most once per
+        MIN_REFETCH_INTERVAL.
+        :param token: str
+        :param audience: str
+        :return: dict
+        :raises ValueError: if the token is invalid
+        """
+        certs = self.get_certs()
+        header = jwt.decode_header(token)
+        if header.get('kid') not in certs and \
+                time.monotonic() - self._fetched_at >= MIN_REFETCH_INTERVAL:
+            try:
+                self.refresh()
+                certs = self._certs
+            except requests.RequestException:
+                current_app.logger.exception(
+                    'Failed to refresh the Google certificates, keeping the '
+                    'last-known ones'
+                )
+        return jwt.decode(token, certs=certs, audience=audience)
+
+    def _refresh_in_background(self) -> None:
+        """
+        Private helper method to refresh the certificates in a background
+        greenlet, unless one is already running.
+        :return: None
+        """
+        if self._refreshing is None:
+            self._refreshing = gevent.spawn(
+                self._refresh_quietly, current_app._get_current_object()
+            )
+
+    def _refresh_quietly(self, app: Flask) -> None:
+        """
+        Private helper method to refresh the certificates, keeping the
+        last-known ones if the refresh fails.
+        :param app: Flask
+        :return: None
+        """
+        try:
+            self._fetch()
+        except requests.RequestException:
+            app.logger.exception(
+                'Failed to refresh the Google certificates, keeping the '
+                'last-known ones'
+            )
+            # Retry after the margin, rather than on every sign-in
+            self._expires_at = time.monotonic() + 2 * self._refresh_margin
+        finally:
+            self._refreshing = None
+
+    def _fetch_as_refresh(self) -> None:
+        """
+        Private helper method to fetch the certificates as the refresh in
+        progress.
+        :return: None
+        :raises requests.RequestException: if the certificates can't be fetched
+        """
+        try:
+            self._fetch()
+        finally:
+            self._refreshing = None
+
+    def _fetch(self) -> None:
+        """
+        Private helper method to fetch the certificates.
+        :return: None
+        :raises requests.RequestException: if the certificates can't be fetched
+        """
+        r = requests.get(self._url, timeout=self._fetch_timeout)
+        r.raise_for_status()
+        self._certs = r.json()
+        self._fetched_at = time.monotonic()
+        self._expires_at = self._fetched_at + self._get_max_age(r)
+
+    def _get_max_age(self, r: requests.Response) -> int:
+        """
+        Private helper method to get the max-age of the given certificates
+        response, from its "Cache-Control" header.
+        :param r: requests.Response
+        :return: int
+        """
+        match = _MAX_AGE_PATTERN.search(r.headers.get('Cache-Control', ''))
+        if match:
+            return int(match.group(1))
+        return self._default_max_age
+
+
+google_certs = GoogleCertsCache()
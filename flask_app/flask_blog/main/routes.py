@@ -4,13 +4,16 @@
 Flask main-related routes module.
 """
 
-from datetime import datetime
+from urllib.parse import quote_plus
 
 import requests
-from flask import Blueprint, flash, redirect, render_template, request, url_for
+from flask import (
+    Blueprint, abort, flash, jsonify, redirect, render_template, request, url_for
+)
 from flask_login import current_user
 
-from ..utils import POST_SERVICE, get_iter_pages
+from ..client import service_client
+from ..utils import POST_SERVICE, get_page_context, render_page
 
 # Create a main-related blueprint
 main_bp = Blueprint(name='main', import_name=__name__)
@@ -24,8 +27,12 @@ def home():
     :return:
     """
     page = request.args.get('page', type=int, default=1)
+    after = request.args.get('after')
 
     request_url = f'{POST_SERVICE}/posts?page={page}&per_page=5'
+    if after is not None:  # Cursor mode, whose cost doesn't grow with depth
+        request_url += f'&after={quote_plus(after)}'
+    url_args = {}
 
     username = request.args.get('user')
     if username:
@@ -39,26 +46,63 @@ def home():
                 'You can only view your own followed posts.', category='danger'
             )
             return redirect(url_for('main.home', user=current_user.username))
-        request_url += f'&user={username}'
+        request_url += f'&user={quote_plus(username)}'
+        url_args['user'] = username
 
-    r = requests.get(request_url)
+    try:
+        # Fall back to the last page we got if post_service is failing.
+        r = service_client.conditional_get(request_url, stale_if_error=True)
+    except requests.RequestException:
+        abort(503)
+    if r.stale:
+        flash(
+            'Posts are temporarily unavailable, showing the last ones we got.',
+            category='info'
+        )
+    if r.status_code == 400:  # Invalid pagination arguments
+        flash(r.json()['message'], category='danger')
+        return redirect(url_for('main.home', **url_args))
+    elif r.status_code != 200:
+        abort(503)
     paginated_data = r.json()
     posts_data = paginated_data['data']['posts']
-    # Convert the datetime strings back to objects
-    for post in posts_data:
-        post['date_posted'] = datetime.fromisoformat(post['date_posted'])
-    pages = paginated_data['pagination_meta']['pages']
 
     context = {
-        'p': {
-            'items': posts_data,
-            'page': page,
-            'pages': pages,
-            'total': paginated_data['pagination_meta']['total'],
-            'iter_pages': get_iter_pages(pages, page)
-        }
+        'p': get_page_context(
+            posts_data, paginated_data['pagination_meta'], page, **url_args
+        )
     }
-    return render_template('home.html', **context)
+    return render_page('home.html', **context)
+
+
+@main_bp.route('/search')
+def search():
+    """
+    Post search page.
+    :return:
+    """
+    terms = request.args.get('q', '').strip()
+    if not terms:
+        return redirect(url_for('main.home'))
+    page = request.args.get('page', type=int, default=1)
+
+    r = service_client.conditional_get(
+        f'{POST_SERVICE}/posts?q={quote_plus(terms)}&page={page}&per_page=5'
+    )
+    if r.status_code != 200:
+        flash(r.json()['message'], category='danger')
+        return redirect(url_for('main.home'))
+    paginated_data = r.json()
+    posts_data = paginated_data['data']['posts']
+
+    context = {
+        'title': 'Search',
+        'terms': terms,
+        'p': get_page_context(
+            posts_data, paginated_data['pagination_meta'], page, q=terms
+        )
+    }
+    return render_page('search.html', **context)
 
 
 @main_bp.route('/about')
@@ -71,3 +115,17 @@ def about():
         'title': 'About'
     }
     return render_template('about.html', **context)
+
+
+@main_bp.route('/service-stats')
+def service_stats():
+    """
+    Statistics of the backend service calls of the serving worker.
+    Internal only, since they expose the backend endpoints and their state:
+    nginx doesn't forward it, and the requests that went through a proxy are
+    rejected as well.
+    :return:
+    """
+    if 'X-Forwarded-For' in request.headers:
+        abort(404)
+    return jsonify(service_client.get_stats())
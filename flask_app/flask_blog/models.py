@@ -6,10 +6,11 @@ Flask models module.
 
 from typing import Optional
 
-import requests
 from flask_login import UserMixin
 
 from . import login_manager
+from .client import service_client
+from .user_cache import user_cache
 from .utils import USER_SERVICE
 
 
@@ -48,10 +49,16 @@ def user_loader(user_id: int) -> Optional[User]:
 
 def _get_user(id: int) -> Optional[dict]:
     """
-    Private helper function to return the user with the given email.
+    Private helper function to return the user with the given ID, from the
+    user snapshot cache if possible.
     :param id: int
     :return: dict or None
     """
-    r = requests.get(f'{USER_SERVICE}/users/{id}')
+    user_data = user_cache.get(id)
+    if user_data is not None:
+        return user_data
+    r = service_client.conditional_get(f'{USER_SERVICE}/users/{id}')
     if r.status_code == 200:
-        return r.json()['data']
+        user_data = r.json()['data']
+        user_cache.store(user_data)
+        return user_data
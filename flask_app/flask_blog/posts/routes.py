@@ -4,17 +4,18 @@
 Flask post-related routes module.
 """
 
-from datetime import datetime
+from typing import Iterator
+from urllib.parse import quote_plus
 
 import flask_login
-import requests
 from flask import (
     Blueprint, current_app, flash, redirect, render_template, request, url_for
 )
 from flask_login import current_user
 
 from . import forms
-from ..utils import POST_SERVICE, send_email
+from ..client import parse_datetime, service_client
+from ..utils import POST_SERVICE, render_page, send_email
 
 # Create a posts-related blueprint
 posts_bp = Blueprint(name='posts', import_name=__name__)
@@ -27,21 +28,60 @@ def post_detail(id: int):
     :param id: int
     :return:
     """
-    r = requests.get(f'{POST_SERVICE}/posts/{id}')
+    r = service_client.conditional_get(f'{POST_SERVICE}/posts/{id}')
     if r.status_code == 404:
         flash(r.json()['message'], category='danger')
         return redirect(url_for('main.home'))
     post_data = r.json()['data']
-    # Convert the datetime strings back to objects
-    post_data['date_posted'] = datetime.fromisoformat(post_data['date_posted'])
-    for comment in post_data['comments']:
-        comment['date_posted'] = datetime.fromisoformat(comment['date_posted'])
+    # Convert the datetime strings back to objects, if not native already
+    post_data['date_posted'] = parse_datetime(post_data['date_posted'])
 
     context = {
         'title': post_data['title'],
-        'post': post_data
+        'post': post_data,
+        'comments': _iter_comments(post_data['comments'])
+    }
+    return render_page('post_detail.html', **context)
+
+
+def _iter_comments(comments_data: list) -> Iterator[dict]:
+    """
+    Private helper function to lazily convert the datetime strings of the
+    given comments back to objects, as they are rendered.
+    :param comments_data: list[dict]
+    :return: iterator[dict]
+    """
+    for comment in comments_data:
+        comment['date_posted'] = parse_datetime(comment['date_posted'])
+        yield comment
+
+
+@posts_bp.route('/posts/<int:id>/comments')
+def post_comments(id: int):
+    """
+    Fragment of the next page of comments on a post, loaded incrementally by
+    the post detail page.
+    The cursor of the following page is returned in the "X-Next-Cursor"
+    header, and is empty for the last page.
+    :param id: int
+    :return:
+    """
+    after = request.args.get('after', '')
+    r = service_client.conditional_get(
+        f'{POST_SERVICE}/posts/{id}/comments?after={quote_plus(after)}'
+    )
+    if r.status_code != 200:
+        return r.json()['message'], r.status_code
+    comments_data = r.json()
+    comments = comments_data['data']
+    # Convert the datetime strings back to objects, if not native already
+    for comment in comments:
+        comment['date_posted'] = parse_datetime(comment['date_posted'])
+    return render_template(
+        'partials/comments_list.html', comments=comments
+    ), 200, {
+        'X-Next-Cursor': comments_data['pagination_meta']['next_cursor'] or ''
     }
-    return render_template('post_detail.html', **context)
 
 
 @posts_bp.route('/like-post/<int:post_id>', methods=['POST'])
@@ -52,7 +92,7 @@ def like_post(post_id: int):
     :param post_id: int
     :return:
     """
-    r = requests.post(f'{POST_SERVICE}/posts/{post_id}/likes')
+    r = service_client.post(f'{POST_SERVICE}/posts/{post_id}/likes')
     if r.status_code == 404:
         flash(r.json()['message'], category='danger')
         return redirect(url_for('main.home'))
@@ -74,7 +114,7 @@ def comment_post(post_id: int):
     :return:
     """
     comment = request.form['comment']
-    r = requests.post(
+    r = service_client.post(
         f'{POST_SERVICE}/posts/{post_id}/comments',
         json={
             'user_id': current_user.id,
@@ -103,7 +143,7 @@ def new_post():
     """
     form = forms.PostForm()
     if form.validate_on_submit():  # Successfully passed form validation
-        r = requests.post(
+        r = service_client.post(
             f'{POST_SERVICE}/posts',
             json={
                 'user_id': current_user.id,
@@ -131,23 +171,28 @@ def update_post(id: int):
     :param id: int
     :return:
     """
-    check_result = _post_existence_and_permission_check(id)
-    if not isinstance(check_result, dict):  # Check failed, redirection
-        return check_result
-    post_data = check_result
-
     form = forms.PostForm()
     if form.validate_on_submit():  # Successfully passed form validation
-        r = requests.put(
+        # The existence and permission checks are done by post_service as part
+        # of the update itself.
+        r = service_client.put(
             f'{POST_SERVICE}/posts/{id}',
             json={
+                'user_id': current_user.id,
                 'title': form.title.data,
                 'content': form.content.data
             }
         )
+        if r.status_code != 200:
+            return _post_write_failure(r, id)
         flash('Your post has been updated!', category='success')
-        return redirect(url_for('posts.post_detail', id=post_data['id']))
-    elif request.method == 'GET':  # "GET" request
+        return redirect(url_for('posts.post_detail', id=id))
+
+    check_result = _post_existence_and_permission_check(id)
+    if not isinstance(check_result, dict):  # Check failed, redirection
+        return check_result
+    post_data = check_result
+    if request.method == 'GET':  # "GET" request
         # Populate the form with the current post's data
         form.title.data = post_data['title']
         form.content.data = post_data['content']
@@ -168,15 +213,32 @@ def delete_post(id: int):
     :param id: int
     :return:
     """
-    check_result = _post_existence_and_permission_check(id)
-    if not isinstance(check_result, dict):  # Check failed, redirection
-        return check_result
-
-    requests.delete(f'{POST_SERVICE}/posts/{id}')
+    # The existence and permission checks are done by post_service as part of
+    # the deletion itself.
+    r = service_client.delete(
+        f'{POST_SERVICE}/posts/{id}?user_id={current_user.id}'
+    )
+    if r.status_code != 204:
+        return _post_write_failure(r, id)
     flash('Your post has been deleted.', category='success')
     return redirect(url_for('main.home'))
 
 
+def _post_write_failure(r, post_id: int):
+    """
+    Private helper function to report a post write rejected by post_service,
+    because the post doesn't exist, or the current logged-in user is not its
+    author.
+    :param r: requests.Response
+    :param post_id: int
+    :return:
+    """
+    flash(r.json()['message'], category='danger')
+    if r.status_code == 403:
+        return redirect(url_for('posts.post_detail', id=post_id))
+    return redirect(url_for('main.home'))
+
+
 def _post_existence_and_permission_check(post_id: int):
     """
     Private helper function to check whether a post with the given ID exists,
@@ -187,7 +249,7 @@ def _post_existence_and_permission_check(post_id: int):
     :return:
     """
     # Check whether a post with the given ID exists
-    r = requests.get(f'{POST_SERVICE}/posts/{post_id}')
+    r = service_client.conditional_get(f'{POST_SERVICE}/posts/{post_id}')
     if r.status_code == 404:
         flash(r.json()['message'], category='danger')
         return redirect(url_for('main.home'))
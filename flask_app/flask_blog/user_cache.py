@@ -0,0 +1,106 @@
+# -*- coding: utf-8 -*-
+
+"""
+Logged-in user snapshot cache module.
+
+Flask-Login reloads the logged-in user on every request, so the user data from
+user_service is cached in two tiers:
+- A small per-worker cache with a short TTL, which serves most of the page
+  loads without any network hop
+- Redis, shared by all the workers, with a longer TTL
+The snapshots are invalidated by this application whenever it changes them
+through user_service, i.e., on account updates and follows/unfollows. Since the
+other workers only notice the invalidation through Redis, they may serve their
+own stale snapshots for up to "USER_CACHE_LOCAL_TTL".
+"""
+
+import json
+from typing import Optional, Union
+
+from cachetools import TTLCache
+from flask import Flask, current_app
+from redis import RedisError
+
+from . import redis_store
+
+USER_SNAPSHOT_KEY = 'user_snapshot:{}'
+
+
+class UserCache:
+    """
+    Two-tier cache of the user snapshots.
+    """
+
+    def __init__(self):
+        self._local_snapshots = None
+
+    def init_app(self, app: Flask) -> None:
+        """
+        Initializes the per-worker tier with the given application's
+        configuration.
+        :param app: Flask
+        :return: None
+        """
+        self._local_snapshots = TTLCache(
+            maxsize=app.config['USER_CACHE_LOCAL_SIZE'],
+            ttl=app.config['USER_CACHE_LOCAL_TTL']
+        )
+
+    def get(self, id: Union[int, str]) -> Optional[dict]:
+        """
+        Gets the cached snapshot of the user with the given ID, if any.
+        Flask-Login gives the IDs as strings, so the IDs are normalized to
+        integers, for the per-worker tier to be keyed consistently.
+        :param id: int or str
+        :return: dict or None
+        """
+        id = int(id)
+        user_data = self._local_snapshots.get(id)
+        if user_data is not None:
+            return user_data
+        try:
+            cached = redis_store.get(USER_SNAPSHOT_KEY.format(id))
+        except RedisError:
+            current_app.logger.exception('User snapshot cache unavailable')
+            return None
+        if cached is None:
+            return None
+        user_data = json.loads(cached)
+        self._local_snapshots[id] = user_data
+        return user_data
+
+    def store(self, user_data: dict) -> None:
+        """
+        Caches the given user data as the snapshot of the user.
+        :param user_data: dict
+        :return: None
+        """
+        id = int(user_data['id'])
+        self._local_snapshots[id] = user_data
+        try:
+            redis_store.set(
+                USER_SNAPSHOT_KEY.format(id),
+                json.dumps(user_data),
+                ex=current_app.config['USER_CACHE_TTL']
+            )
+        except RedisError:
+            current_app.logger.exception('User snapshot cache unavailable')
+
+    def invalidate(self, *ids: Union[int, str]) -> None:
+        """
+        Invalidates the cached snapshots of the users with the given IDs.
+        :param ids: int or str
+        :return: None
+        """
+        ids = [int(id) for id in ids]
+        for id in ids:
+            self._local_snapshots.pop(id, None)
+        try:
+            redis_store.delete(*(USER_SNAPSHOT_KEY.format(id) for id in ids))
+        except RedisError:
+            current_app.logger.exception(
+                'Failed to invalidate the user snapshots'
+            )
+
+
+user_cache = UserCache()
@@ -4,29 +4,116 @@
 Utility functions.
 """
 
+from flask import (
+    Response, current_app, get_flashed_messages, render_template,
+    stream_with_context
+)
+
 from .celerytasks import send_email_async
+from .fragments import fragment_cache
 
 USER_SERVICE = 'http://user_service:8000'
 POST_SERVICE = 'http://post_service:8000'
 
 
-def get_iter_pages(pages: int, page: int, edge: int=2, around: int=2) -> list:
+def get_iter_pages(pages: int, page: int, edge: int=2, around: int=2,
+                   approximate: bool=False) -> list:
     """
-    Gets the iteration pages to display on the page bottom.
+    Gets the iteration pages to display on the page bottom, where None stands
+    for a gap.
+    If the total number of pages is approximate, the last pages are not linked,
+    and a trailing gap stands for the pages after.
     :param pages: int
     :param page: int
     :param edge: int
     :param around: int
+    :param approximate: bool
     :return: list
     """
+    last = max(pages, page)
+    shown = set(range(1, min(edge, last) + 1))
+    shown.update(range(max(page - around, 1), min(page + around, last) + 1))
+    if not approximate:
+        shown.update(range(max(last - edge + 1, 1), last + 1))
+
     iter_pages = []
-    for i in range(1, pages + 1):
-        if i == page or i <= edge or i > pages - edge or i >= page - around or \
-                i <= page + around:
-            iter_pages.append(i)
+    previous = 0
+    for i in sorted(shown):
+        if i > previous + 1:
+            iter_pages.append(None)
+        iter_pages.append(i)
+        previous = i
+    if approximate and previous < last:
+        iter_pages.append(None)
     return iter_pages
 
 
+def get_page_context(posts_data: list, pagination_meta: dict, page: int,
+                     **url_args) -> dict:
+    """
+    Gets the context of a page of posts, to be rendered by
+    "partials/posts_list.html" and "partials/pagination.html".
+    The posts are lazily rendered through the fragment cache while the page is
+    rendered, so their "date_posted" are left as strings.
+    In cursor mode, post_service doesn't report the total number of posts and
+    pages, so only the link to the older posts is available.
+    :param posts_data: list[dict]
+    :param pagination_meta: dict
+    :param page: int
+    :param url_args: the arguments to keep when linking to another page
+    :return: dict
+    """
+    pages = pagination_meta.get('pages')
+    total_is_estimate = pagination_meta.get('total_is_estimate', False)
+    if pages:
+        iter_pages = get_iter_pages(pages, page, approximate=total_is_estimate)
+    else:
+        iter_pages = []
+    return {
+        'fragments': fragment_cache.iter_post_summaries(posts_data),
+        'page': page,
+        'pages': pages,
+        'total': pagination_meta.get('total'),
+        'total_is_estimate': total_is_estimate,
+        'iter_pages': iter_pages,
+        'next_cursor': pagination_meta.get('next_cursor'),
+        'url_args': url_args
+    }
+
+
+def render_page(template_name: str, **context):
+    """
+    Renders the given page template, streaming it if enabled by
+    "STREAM_PAGES", so that the header and layout are sent as soon as they are
+    rendered, while the rest of the page is rendered from the lazy iterables in
+    the context.
+    Since the views call the backend services before rendering, the time to
+    first byte still includes those calls. Note that once streaming, errors can
+    no longer turn into an error page.
+    :param template_name: str
+    :param context: the template context
+    :return:
+    """
+    if not current_app.config['STREAM_PAGES']:
+        return render_template(template_name, **context)
+
+    # Pop the flashed messages now, so that the session change is saved before
+    # the headers are sent.
+    get_flashed_messages(with_categories=True)
+    app = current_app._get_current_object()
+    app.update_template_context(context)
+    stream = app.jinja_env.get_template(template_name).stream(context)
+    # Send the page in chunks of template events, rather than one by one.
+    stream.enable_buffering(current_app.config['STREAM_BUFFER_SIZE'])
+    return Response(
+        stream_with_context(stream),
+        mimetype='text/html',
+        headers={
+            'X-Accel-Buffering': 'no'  # Don't let Nginx buffer the stream
+        }
+    )
+
+
 def send_email(recipient: str, subject: str, body: str) -> None:
     """
     Sends an email to the given recipient, with the given subject and body.
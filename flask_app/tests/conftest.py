@@ -0,0 +1,113 @@
+# -*- coding: utf-8 -*-
+
+"""
+Test fixtures.
+The application runs in gevent workers, so the tests run under the gevent
+monkey-patching as well, and the backend services are stood in for by a local
+HTTP stub server.
+"""
+
+import gevent
+from gevent import monkey
+
+monkey.patch_all()
+
+import os
+
+os.environ.setdefault('FLASK_SECRET_KEY', 'test')
+os.environ.setdefault('POSTGRES_USER', 'test')
+os.environ.setdefault('POSTGRES_PASSWORD', 'test')
+os.environ.setdefault('MAIL_USERNAME', 'test')
+os.environ.setdefault('MAIL_PASSWORD', 'test')
+
+import json
+from typing import Callable, Tuple
+
+import pytest
+from flask import Flask
+from gevent.pywsgi import WSGIServer
+
+from flask_blog.client import ServiceClient
+from flask_blog.config import Config
+
+
+class StubServer:
+    """
+    Local HTTP stub server, answering every request with the handler set by
+    the test, which takes the WSGI environ, and returns the status code, the
+    headers and the body.
+    """
+
+    def __init__(self):
+        self.handler = lambda environ: (200, {}, {})
+        self.calls = 0
+        self._server = WSGIServer(('127.0.0.1', 0), self._app, log=None)
+
+    @property
+    def port(self) -> int:
+        return self._server.server_port
+
+    @property
+    def url(self) -> str:
+        return f'http://127.0.0.1:{self.port}'
+
+    def start(self) -> None:
+        self._server.start()
+
+    def stop(self) -> None:
+        self._server.stop(timeout=0)
+
+    def _app(self, environ: dict, start_response: Callable) -> list:
+        self.calls += 1
+        status_code, headers, body = self.handler(environ)
+        if not isinstance(body, bytes):
+            body = json.dumps(body).encode()
+            headers = {'Content-Type': 'application/json', **headers}
+        start_response(f'{status_code} Stub', list(headers.items()))
+        return [body]
+
+
+@pytest.fixture
+def stub_server():
+    server = StubServer()
+    server.start()
+    yield server
+    server.stop()
+
+
+@pytest.fixture
+def app() -> Flask:
+    app = Flask(__name__)
+    app.config.from_object(Config)
+    return app
+
+
+@pytest.fixture
+def make_client(app: Flask) -> Callable[..., ServiceClient]:
+    """
+    Returns a factory of service clients, configured with the application's
+    configuration overridden by the given keyword arguments.
+    """
+
+    def make_client(**config) -> ServiceClient:
+        app.config.update(config)
+        client = ServiceClient()
+        client.init_app(app)
+        return client
+
+    return make_client
+
+
+def respond_after(delay: float, status_code: int=200,
+                  body=None) -> Callable[[dict], Tuple[int, dict, object]]:
+    """
+    Returns a stub handler answering with the given status code and body
+    after the given delay (in seconds).
+    """
+
+    def handler(environ: dict) -> Tuple[int, dict, object]:
+        gevent.sleep(delay)
+        return status_code, {}, {} if body is None else body
+
+    return handler
+
@@ -0,0 +1,267 @@
+# -*- coding: utf-8 -*-
+
+import time
+
+import gevent
+import pytest
+import requests
+
+from flask_blog.client import (
+    AdaptiveTimeout, CircuitBreaker, DeadlineExceeded, RetryBudget
+)
+
+from .conftest import respond_after
+
+
+def test_breaker_opens_at_threshold():
+    breaker = CircuitBreaker(failure_threshold=3, reset_timeout=10)
+
+    for _ in range(2):
+        breaker.record_failure()
+    assert breaker.state == CircuitBreaker.CLOSED
+    assert breaker.allow()
+
+    breaker.record_failure()
+    assert breaker.state == CircuitBreaker.OPEN
+    assert not breaker.allow()
+
+
+def test_breaker_success_resets_failures():
+    breaker = CircuitBreaker(failure_threshold=2, reset_timeout=10)
+
+    breaker.record_failure()
+    breaker.record_success()
+    breaker.record_failure()
+    assert breaker.state == CircuitBreaker.CLOSED
+
+
+def test_breaker_lets_single_trial_through_when_half_open():
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=0.05)
+    breaker.record_failure()
+    time.sleep(0.05)
+
+    assert breaker.allow()
+    assert breaker.state == CircuitBreaker.HALF_OPEN
+    assert not breaker.allow()  # The trial is still in flight
+
+    breaker.record_success()
+    assert breaker.state == CircuitBreaker.CLOSED
+    assert breaker.allow()
+
+
+def test_breaker_reopens_on_failed_trial():
+    breaker = CircuitBreaker(failure_threshold=3, reset_timeout=0.05)
+    for _ in range(3):
+        breaker.record_failure()
+    time.sleep(0.05)
+
+    assert breaker.allow()
+    breaker.record_failure()
+    assert breaker.state == CircuitBreaker.OPEN
+    assert not breaker.allow()
+
+
+def test_breaker_released_on_cancelled_trial(stub_server, make_client):
+    stub_server.handler = respond_after(0, status_code=500)
+    client = make_client(
+        SERVICE_MAX_RETRIES=0, SERVICE_BREAKER_THRESHOLD=1,
+        SERVICE_BREAKER_RESET_TIMEOUT=0.05
+    )
+    client.get(f'{stub_server.url}/posts')
+    breaker = client._get_breaker(f'127.0.0.1:{stub_server.port}')
+    assert breaker.state == CircuitBreaker.OPEN
+    time.sleep(0.05)
+
+    stub_server.handler = respond_after(1.0)
+    trial = gevent.spawn(client.get, f'{stub_server.url}/posts')
+    gevent.sleep(0.05)
+    assert breaker.state == CircuitBreaker.HALF_OPEN
+    trial.kill()
+
+    # The next trial is let through, rather than the circuit staying stuck
+    assert breaker.allow()
+
+
+def test_adaptive_timeout_starts_at_max():
+    adaptive_timeout = AdaptiveTimeout(min_timeout=0.25, max_timeout=5.0)
+
+    assert adaptive_timeout.timeout == 5.0
+    assert adaptive_timeout.hedge_delay is None
+
+
+def test_adaptive_timeout_follows_latencies():
+    adaptive_timeout = AdaptiveTimeout(min_timeout=0.25, max_timeout=5.0)
+
+    adaptive_timeout.observe(0.1)
+    # 0.1 + 4 * 0.05
+    assert adaptive_timeout.timeout == pytest.approx(0.3)
+    assert adaptive_timeout.hedge_delay == pytest.approx(0.2)
+
+    for _ in range(50):
+        adaptive_timeout.observe(0.01)
+    assert adaptive_timeout.timeout == 0.25  # The minimum
+
+
+def test_adaptive_timeout_back_off_doubles():
+    adaptive_timeout = AdaptiveTimeout(min_timeout=0.25, max_timeout=5.0)
+    adaptive_timeout.observe(0.1)
+
+    adaptive_timeout.back_off()
+    assert adaptive_timeout.timeout == pytest.approx(0.6)
+    adaptive_timeout.back_off()
+    assert adaptive_timeout.timeout == pytest.approx(1.2)
+    for _ in range(5):
+        adaptive_timeout.back_off()
+    assert adaptive_timeout.timeout == 5.0  # The maximum
+
+
+def test_retry_budget():
+    budget = RetryBudget(ratio=0.5, max_tokens=2)
+
+    assert budget.withdraw()
+    assert budget.withdraw()
+    assert not budget.withdraw()
+
+    budget.deposit()
+    assert not budget.withdraw()
+    budget.deposit()
+    assert budget.withdraw()
+
+    for _ in range(10):
+        budget.deposit()
+    assert budget.withdraw()
+    assert budget.withdraw()
+    assert not budget.withdraw()  # Capped at max_tokens
+
+
+def test_retries_limited_by_budget(stub_server, make_client):
+    stub_server.handler = respond_after(0, status_code=503)
+    client = make_client(SERVICE_MAX_RETRIES=2, SERVICE_RETRY_RATIO=0.0)
+    client._get_retry_budget(f'127.0.0.1:{stub_server.port}')._tokens = 1
+
+    assert client.get(f'{stub_server.url}/posts').status_code == 503
+    assert stub_server.calls == 2  # A single retry
+
+
+def test_hedge_losing_on_server_error(stub_server, make_client):
+    def handler(environ):
+        if stub_server.calls == 1:  # The primary request
+            return respond_after(0.2)(environ)
+        return respond_after(0, status_code=503)(environ)
+
+    stub_server.handler = handler
+    client = make_client()
+
+    r = client._send(
+        'GET', f'{stub_server.url}/posts', 0.05, RetryBudget(0.1),
+        timeout=(1.0, 1.0)
+    )
+    # The hedged request answered first, but with a server error
+    assert stub_server.calls == 2
+    assert r.status_code == 200
+
+
+def test_hedge_winning(stub_server, make_client):
+    def handler(environ):
+        if stub_server.calls == 1:  # The primary request
+            return respond_after(1.0)(environ)
+        return respond_after(0, body={'hedged': True})(environ)
+
+    stub_server.handler = handler
+    client = make_client()
+
+    start = time.monotonic()
+    r = client._send(
+        'GET', f'{stub_server.url}/posts', 0.05, RetryBudget(0.1),
+        timeout=(1.0, 2.0)
+    )
+    assert r.json() == {'hedged': True}
+    assert time.monotonic() - start < 0.5
+
+
+def test_hedges_both_failing(stub_server, make_client):
+    def handler(environ):
+        if stub_server.calls == 1:  # The primary request
+            return respond_after(0.2, status_code=502)(environ)
+        return respond_after(0, status_code=503)(environ)
+
+    stub_server.handler = handler
+    client = make_client()
+
+    r = client._send(
+        'GET', f'{stub_server.url}/posts', 0.05, RetryBudget(0.1),
+        timeout=(1.0, 1.0)
+    )
+    # The server error of the last one to answer
+    assert r.status_code == 502
+
+
+def test_hedge_limited_by_budget(stub_server, make_client):
+    stub_server.handler = respond_after(0.2)
+    client = make_client()
+    budget = RetryBudget(0.1)
+    budget._tokens = 0
+
+    r = client._send(
+        'GET', f'{stub_server.url}/posts', 0.05, budget, timeout=(1.0, 1.0)
+    )
+    assert r.status_code == 200
+    assert stub_server.calls == 1
+
+
+def test_fixed_timeout_endpoint(stub_server, make_client):
+    stub_server.handler = respond_after(0.3)
+    client = make_client(
+        SERVICE_TIMEOUTS={'GET 127.0.0.1/user-auth': (1.0, 0.1)},
+        SERVICE_FIXED_TIMEOUT_ENDPOINTS=frozenset(['GET 127.0.0.1/user-auth']),
+        SERVICE_MAX_RETRIES=2, SERVICE_RETRY_RATIO=1.0
+    )
+
+    with pytest.raises(requests.ReadTimeout):
+        client.get(f'{stub_server.url}/user-auth')
+    # Neither hedged nor retried, and no adaptive timeout
+    assert stub_server.calls == 1
+    assert 'GET 127.0.0.1/user-auth' not in client.get_stats()['read_timeouts']
+
+
+def test_deadline_caps_read_timeout(stub_server, make_client):
+    stub_server.handler = respond_after(1.0)
+    client = make_client(SERVICE_HEDGING=False)
+
+    start = time.monotonic()
+    with pytest.raises(DeadlineExceeded):
+        client.get(f'{stub_server.url}/slow', deadline=start + 0.2)
+    # Well within the 5-second read timeout
+    assert time.monotonic() - start < 0.5
+
+
+def test_deadline_passed_skips_call(stub_server, make_client):
+    client = make_client()
+
+    with pytest.raises(DeadlineExceeded):
+        client.get(f'{stub_server.url}/posts', deadline=time.monotonic())
+    assert stub_server.calls == 0
+
+
+def test_deadline_stops_retries(stub_server, make_client):
+    stub_server.handler = respond_after(0, status_code=503)
+    client = make_client(SERVICE_MAX_RETRIES=5, SERVICE_RETRY_RATIO=1.0)
+
+    start = time.monotonic()
+    r = client.get(f'{stub_server.url}/posts', deadline=start + 0.25)
+    # The backoff before a third attempt (0.2s) would end after the deadline
+    assert r.status_code == 503
+    assert stub_server.calls == 2
+    assert time.monotonic() - start < 0.25
+
+
+def test_timeout_before_deadline_is_not_deadline_exceeded(stub_server,
+                                                          make_client):
+    stub_server.handler = respond_after(1.0)
+    client = make_client(SERVICE_HEDGING=False)
+
+    with pytest.raises(requests.Timeout) as excinfo:
+        client.get(f'{stub_server.url}/slow', timeout=0.1,
+                   deadline=time.monotonic() + 5)
+    # Timed out by its own timeout, rather than by the deadline
+    assert not isinstance(excinfo.value, DeadlineExceeded)
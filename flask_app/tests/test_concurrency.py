@@ -0,0 +1,67 @@
+# -*- coding: utf-8 -*-
+
+import functools
+import time
+
+import gevent
+import pytest
+
+from flask_blog.client import DeadlineExceeded
+from flask_blog.concurrency import DEADLINE_GRACE, gather
+
+from .conftest import respond_after
+
+
+def test_gather_collects_results_by_name():
+    results = gather({
+        'a': lambda deadline: 1,
+        'b': lambda deadline: 2
+    }, timeout=1)
+
+    assert results == {'a': 1, 'b': 2}
+
+
+def test_gather_passes_shared_deadline():
+    deadlines = []
+    start = time.monotonic()
+    gather({
+        'a': lambda deadline: deadlines.append(deadline),
+        'b': lambda deadline: deadlines.append(deadline)
+    }, timeout=1)
+
+    assert len(set(deadlines)) == 1
+    assert start + 1 <= deadlines[0] < time.monotonic() + 1
+
+
+def test_gather_service_calls_end_by_deadline(stub_server, make_client):
+    stub_server.handler = lambda environ: respond_after(
+        1.0 if environ['PATH_INFO'] == '/slow' else 0
+    )(environ)
+    client = make_client(SERVICE_HEDGING=False)
+
+    start = time.monotonic()
+    results = gather({
+        'fast': functools.partial(client.get, f'{stub_server.url}/fast'),
+        'slow': functools.partial(client.get, f'{stub_server.url}/slow')
+    }, timeout=0.2, raise_errors=False)
+
+    assert time.monotonic() - start < 0.2 + DEADLINE_GRACE
+    assert results['fast'].status_code == 200
+    # Ended by the client itself, rather than left running
+    assert isinstance(results['slow'], DeadlineExceeded)
+
+
+def test_gather_raises_first_error():
+    def fail(deadline):
+        raise ValueError
+
+    with pytest.raises(ValueError):
+        gather({'ok': lambda deadline: 1, 'failed': fail}, timeout=1)
+
+
+def test_gather_reports_unfinished_calls():
+    results = gather({
+        'stuck': lambda deadline: gevent.sleep(1)
+    }, timeout=0.05, raise_errors=False)
+
+    assert isinstance(results['stuck'], DeadlineExceeded)
@@ -0,0 +1,159 @@
+# -*- coding: utf-8 -*-
+
+import time
+
+import gevent
+import pytest
+import rsa
+from google.auth import crypt, jwt
+
+from flask_blog import google_certs as google_certs_module
+from flask_blog.google_certs import GoogleCertsCache
+
+from .conftest import respond_after
+
+AUDIENCE = 'test-client-id'
+
+
+def _make_key(key_id: str):
+    """
+    Returns a signer with a new RSA key, and its public key in PEM, which
+    stands in for its certificate.
+    """
+    public_key, private_key = rsa.newkeys(1024)
+    signer = crypt.RSASigner.from_string(
+        private_key.save_pkcs1(), key_id=key_id
+    )
+    return signer, public_key.save_pkcs1().decode()
+
+
+@pytest.fixture(scope='module')
+def keys() -> dict:
+    return {key_id: _make_key(key_id) for key_id in ('k1', 'k2', 'k3')}
+
+
+def _make_token(signer) -> str:
+    now = int(time.time())
+    return jwt.encode(signer, {
+        'aud': AUDIENCE, 'sub': '42', 'iat': now, 'exp': now + 300
+    }).decode()
+
+
+def _serve_certs(stub_server, keys: dict, key_ids, max_age: int=None) -> None:
+    headers = {}
+    if max_age is not None:
+        headers['Cache-Control'] = f'public, max-age={max_age}, must-revalidate'
+    certs = {key_id: keys[key_id][1] for key_id in key_ids}
+    stub_server.handler = lambda environ: (200, headers, certs)
+
+
+@pytest.fixture
+def make_cache(app, stub_server):
+
+    def make_cache(**config) -> GoogleCertsCache:
+        app.config.update(GOOGLE_CERTS_URL=stub_server.url, **config)
+        cache = GoogleCertsCache()
+        cache.init_app(app)
+        return cache
+
+    return make_cache
+
+
+def test_max_age(stub_server, make_cache, keys):
+    _serve_certs(stub_server, keys, ['k1'], max_age=1234)
+    cache = make_cache()
+
+    assert set(cache.get_certs()) == {'k1'}
+    assert cache._expires_at - cache._fetched_at == 1234
+
+
+def test_default_max_age(stub_server, make_cache, keys):
+    _serve_certs(stub_server, keys, ['k1'])
+    cache = make_cache(GOOGLE_CERTS_DEFAULT_MAX_AGE=600)
+
+    cache.get_certs()
+    assert cache._expires_at - cache._fetched_at == 600
+
+
+def test_refresh_ahead_of_expiry(app, stub_server, make_cache, keys):
+    _serve_certs(stub_server, keys, ['k1'], max_age=3600)
+    cache = make_cache(GOOGLE_CERTS_REFRESH_MARGIN=300)
+    cache.get_certs()
+
+    _serve_certs(stub_server, keys, ['k1', 'k2'], max_age=3600)
+    with app.app_context():
+        cache.get_certs()
+        assert stub_server.calls == 1  # Still fresh
+
+        cache._expires_at = time.monotonic() + 200  # Within the margin
+        # Served from the cache, while refreshed in the background
+        assert set(cache.get_certs()) == {'k1'}
+        gevent.sleep(0.1)
+        assert set(cache.get_certs()) == {'k1', 'k2'}
+    assert stub_server.calls == 2
+
+
+def test_last_known_certs_on_failed_refresh(app, stub_server, make_cache,
+                                            keys):
+    _serve_certs(stub_server, keys, ['k1'], max_age=3600)
+    cache = make_cache(GOOGLE_CERTS_REFRESH_MARGIN=300)
+    cache.get_certs()
+
+    stub_server.handler = respond_after(0, status_code=503)
+    cache._expires_at = time.monotonic() + 200
+    with app.app_context():
+        cache.get_certs()
+        gevent.sleep(0.1)
+        assert stub_server.calls == 2
+
+        assert set(cache.get_certs()) == {'k1'}
+        claims = cache.verify_token(_make_token(keys['k1'][0]), AUDIENCE)
+        assert claims['sub'] == '42'
+    # Retried after the margin, rather than on every sign-in
+    assert stub_server.calls == 2
+
+
+def test_cold_start_fetch_failure(stub_server, make_cache):
+    stub_server.handler = respond_after(0, status_code=503)
+    cache = make_cache()
+
+    with pytest.raises(Exception):
+        cache.get_certs()
+    assert cache._refreshing is None
+
+
+def test_unknown_key_refetch_rate_limited(app, stub_server, make_cache,
+                                          keys):
+    _serve_certs(stub_server, keys, ['k1'], max_age=3600)
+    cache = make_cache()
+    cache.get_certs()
+    _serve_certs(stub_server, keys, ['k1', 'k2'], max_age=3600)
+
+    with app.app_context():
+        # Fetched less than MIN_REFETCH_INTERVAL ago
+        with pytest.raises(ValueError):
+            cache.verify_token(_make_token(keys['k2'][0]), AUDIENCE)
+        assert stub_server.calls == 1
+
+        cache._fetched_at -= google_certs_module.MIN_REFETCH_INTERVAL
+        claims = cache.verify_token(_make_token(keys['k2'][0]), AUDIENCE)
+        assert claims['sub'] == '42'
+        assert stub_server.calls == 2
+
+        # Just refetched
+        with pytest.raises(ValueError):
+            cache.verify_token(_make_token(keys['k3'][0]), AUDIENCE)
+    assert stub_server.calls == 2
+
+
+def test_concurrent_cold_start_fetches_coalesce(stub_server, make_cache,
+                                                keys):
+    certs = {'k1': keys['k1'][1]}
+    stub_server.handler = respond_after(0.1, body=certs)
+    cache = make_cache()
+
+    greenlets = [gevent.spawn(cache.get_certs) for _ in range(5)]
+    gevent.joinall(greenlets, raise_error=True)
+
+    assert all(set(greenlet.value) == {'k1'} for greenlet in greenlets)
+    assert stub_server.calls == 1
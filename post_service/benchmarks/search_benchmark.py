@@ -0,0 +1,138 @@
+# -*- coding: utf-8 -*-
+
+"""
+Full-text post search benchmark.
+
+Optionally seeds the "posts" table with synthetic posts, and then times the
+same search query as "GET /posts?q=" (first page, ranked by relevance) for a few
+terms of different selectivity, checking that the GIN index is used.
+
+Usage (from "post_service/", with the same environment variables as the
+service):
+    python -m benchmarks.search_benchmark --seed 2000000 --runs 50
+"""
+
+import argparse
+import statistics
+import time
+
+from post_service import create_app, db
+from post_service.models import SEARCH_CONFIG, Post, User, post_search_vector
+
+WORDS = [
+    'flask', 'python', 'docker', 'redis', 'postgres', 'gevent', 'celery',
+    'nginx', 'gunicorn', 'oauth', 'google', 'github', 'microservice', 'cache',
+    'index', 'query', 'timeline', 'follower', 'comment', 'like', 'latency',
+    'throughput', 'pagination', 'cursor', 'search', 'ranking', 'benchmark',
+    'deployment', 'container', 'kubernetes', 'serialization', 'marshmallow'
+]
+
+# From frequent to rare terms
+TERMS = ['python', 'redis cache', 'kubernetes marshmallow latency', 'zyzzyva']
+
+
+def seed(n: int) -> None:
+    """
+    Seeds the given number of synthetic posts, with random titles and contents
+    drawn from WORDS, authored by a benchmark user.
+    :param n: int
+    :return: None
+    """
+    user = User.query.filter_by(username='search-benchmark').first()
+    if not user:
+        user = User(
+            username='search-benchmark',
+            email='search-benchmark@example.com',
+            password='!'
+        )
+        db.session.add(user)
+        db.session.flush()
+    # Generate the posts in the database in one statement; referencing "i" in
+    # the subqueries makes them re-evaluated for every post.
+    db.session.execute(
+        """
+        INSERT INTO posts (user_id, title, content, date_posted, likes)
+        SELECT :user_id,
+               array_to_string(ARRAY(
+                   SELECT (:words)[1 + floor(random() * :n_words)::int]
+                   FROM generate_series(1, 5) WHERE i > 0
+               ), ' '),
+               array_to_string(ARRAY(
+                   SELECT (:words)[1 + floor(random() * :n_words)::int]
+                   FROM generate_series(1, 60) WHERE i > 0
+               ), ' '),
+               now() - random() * interval '365 days',
+               0
+        FROM generate_series(1, :n) AS i
+        """,
+        {'user_id': user.id, 'words': WORDS, 'n_words': len(WORDS), 'n': n}
+    )
+    db.session.commit()
+    db.session.execute('ANALYZE posts')
+
+
+def search(terms: str, per_page: int=10) -> list:
+    """
+    Runs the first page of the search for the given terms, as the endpoint does.
+    :param terms: str
+    :param per_page: int
+    :return: list[Post]
+    """
+    ts_query = db.func.plainto_tsquery(SEARCH_CONFIG, terms)
+    return Post.query\
+        .filter(post_search_vector.op('@@')(ts_query))\
+        .order_by(
+            db.func.ts_rank(post_search_vector, ts_query).desc(),
+            Post.date_posted.desc(),
+            Post.id.desc()
+        )\
+        .limit(per_page)\
+        .all()
+
+
+def uses_gin_index(terms: str) -> bool:
+    """
+    Checks whether the search for the given terms is planned on the GIN index.
+    :param terms: str
+    :return: bool
+    """
+    query = Post.query.filter(post_search_vector.op('@@')(
+        db.func.plainto_tsquery(SEARCH_CONFIG, terms)
+    ))
+    compiled = query.statement.compile(dialect=db.engine.dialect)
+    plan = db.session.connection().execute(
+        f'EXPLAIN {compiled}', compiled.params
+    ).fetchall()
+    return any('ix_posts_search_vector' in line for line, in plan)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--runs', type=int, default=50)
+    args = parser.parse_args()
+
+    app = create_app()
+    with app.app_context():
+        if args.seed:
+            seed(args.seed)
+        total = db.session.query(db.func.count(Post.id)).scalar()
+        print(f'{total} posts')
+        print(f'{"terms":<32}{"index":>7}{"p50 ms":>10}{"p99 ms":>10}')
+        for terms in TERMS:
+            search(terms)  # Warm up
+            timings = []
+            for _ in range(args.runs):
+                start = time.perf_counter()
+                search(terms)
+                timings.append((time.perf_counter() - start) * 1000)
+            timings.sort()
+            p99 = timings[min(len(timings) - 1, int(len(timings) * 0.99))]
+            print(
+                f'{terms:<32}{"yes" if uses_gin_index(terms) else "NO":>7}'
+                f'{statistics.median(timings):>10.2f}{p99:>10.2f}'
+            )
+
+
+if __name__ == '__main__':
+    main()
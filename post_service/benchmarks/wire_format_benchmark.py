@@ -0,0 +1,129 @@
+# -*- coding: utf-8 -*-
+
+"""
+Wire format benchmark.
+
+Times the encoding (by post_service) plus the decoding (by flask_app, including
+getting the datetimes back) of a page of posts, in JSON and in MessagePack,
+for a 5-post and a 100-post page.
+Doesn't connect to the database, since the pages are synthetic, but importing
+the "post_service" package loads its configuration, which requires the same
+"FLASK_SECRET_KEY", "POSTGRES_USER" and "POSTGRES_PASSWORD" environment
+variables as the service; any values will do.
+
+Usage (from "post_service/", with the same environment variables as the
+service):
+    python -m benchmarks.wire_format_benchmark --runs 2000
+"""
+
+import argparse
+import json
+import statistics
+import time
+from datetime import datetime, timedelta
+
+import msgpack
+
+from post_service.representations import dumps_json, dumps_msgpack
+
+PAGE_SIZES = [5, 100]
+
+
+def make_page(n: int) -> dict:
+    """
+    Makes a paginated response of the given number of post summaries, shaped
+    as "GET /posts".
+    :param n: int
+    :return: dict
+    """
+    now = datetime.utcnow()
+    author = {
+        'id': 1,
+        'username': 'benchmark',
+        'email': 'benchmark@example.com',
+        'from_oauth': False,
+        'image_filename': 'default.jpg',
+        'following_count': 42,
+        'follower_count': 4242,
+        'version': 7
+    }
+    posts = [
+        {
+            'id': i,
+            'author': author,
+            'title': f'Post {i} about wire formats',
+            'content': 'Lorem ipsum dolor sit amet, consectetur adipiscing '
+                       'elit, sed do eiusmod tempor incididunt ut labore. ' * 4,
+            'date_posted': now - timedelta(minutes=i),
+            'likes': i * 3,
+            'version': 2,
+            'comment_count': i % 7
+        }
+        for i in range(n)
+    ]
+    return {
+        'status': 'success',
+        'data': {
+            'user_data': {},
+            'posts': posts
+        },
+        'pagination_meta': {
+            'page': 1,
+            'pages': 100,
+            'total': 100 * n,
+            'total_is_estimate': False,
+            'next_cursor': 'WyIyMDIwLTAxLTAxVDAwOjAwOjAwIiwgMV0'
+        }
+    }
+
+
+def json_round_trip(page: dict) -> dict:
+    body = dumps_json(page)
+    data = json.loads(body)
+    for post in data['data']['posts']:
+        post['date_posted'] = datetime.fromisoformat(post['date_posted'])
+    return data
+
+
+def msgpack_round_trip(page: dict) -> dict:
+    body = dumps_msgpack(page)
+    return msgpack.unpackb(body, raw=False, timestamp=3)
+
+
+def time_round_trip(round_trip, page: dict, runs: int) -> float:
+    """
+    Times the given round trip of the given page, in microseconds per run
+    (median of 5 batches).
+    :param round_trip: Callable
+    :param page: dict
+    :param runs: int
+    :return: float
+    """
+    batches = []
+    for _ in range(5):
+        start = time.perf_counter()
+        for _ in range(runs):
+            round_trip(page)
+        batches.append((time.perf_counter() - start) / runs * 1e6)
+    return statistics.median(batches)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--runs', type=int, default=2000)
+    args = parser.parse_args()
+
+    print(f'{"posts":>6}{"format":>10}{"bytes":>10}{"us/page":>10}')
+    for n in PAGE_SIZES:
+        page = make_page(n)
+        for name, dumps, round_trip in [
+            ('json', dumps_json, json_round_trip),
+            ('msgpack', dumps_msgpack, msgpack_round_trip)
+        ]:
+            size = len(dumps(page))
+            elapsed = time_round_trip(round_trip, page, max(args.runs // n, 10))
+            print(f'{n:>6}{name:>10}{size:>10}{elapsed:>10.1f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -3,9 +3,11 @@ from flask_marshmallow import Marshmallow
 from flask_sqlalchemy import SQLAlchemy
 
 from .config import Config
+from .redis_ext import RedisStore
 
 db = SQLAlchemy()
 ma = Marshmallow()
+redis_store = RedisStore()
 
 
 def create_app(config=Config) -> Flask:
@@ -18,10 +20,22 @@ def create_app(config=Config) -> Flask:
 
     db.init_app(app)
     ma.init_app(app)  # Order matters: Initialize SQLAlchemy before Marshmallow
+    redis_store.init_app(app)
 
     from .api import api_bp
     app.register_blueprint(api_bp)
 
+    from .commands import (
+        flush_likes_command, rebuild_timelines_command,
+        reset_post_counters_command
+    )
+    app.cli.add_command(rebuild_timelines_command)
+    app.cli.add_command(flush_likes_command)
+    app.cli.add_command(reset_post_counters_command)
+
+    from .likes import start_likes_flusher
+    start_likes_flusher(app)
+
     # db.create_all(app=app)
 
     return app
@@ -7,13 +7,16 @@ API definition module.
 from flask import Blueprint
 from flask_restful import Api
 
-from .resources.post import PostComments, PostItem, PostLike, PostList
+from .representations import register_representations
+from .resources.post import CacheStats, PostComments, PostItem, PostLike, PostList
 
 # Create an API-related blueprint
 api_bp = Blueprint(name='api', import_name=__name__)
 
 api = Api(api_bp)
+register_representations(api)
 api.add_resource(PostList, '/posts')
 api.add_resource(PostItem, '/posts/<int:id>')
 api.add_resource(PostLike, '/posts/<int:post_id>/likes')
 api.add_resource(PostComments, '/posts/<int:post_id>/comments')
+api.add_resource(CacheStats, '/cache-stats')
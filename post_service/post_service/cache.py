@@ -0,0 +1,253 @@
+# -*- coding: utf-8 -*-
+
+"""
+Versioned response cache module.
+
+The responses of the read endpoints are cached in Redis, under keys embedding
+version numbers that the writes bump, so that a write makes the affected cached
+responses unreachable right away, instead of having to find and delete them:
+- The generation, bumped by user_service when the profiles embedded in the
+  posts change
+- The list version, bumped when any listing of posts changes
+- The post versions, bumped when a single post changes
+The unreachable entries then expire by TTL, or get evicted by the LRU policy of
+Redis ("volatile-lru") under memory pressure.
+The follow counts of the embedded users change too often to bump the
+generation for them, so instead each entry is checked on read against the
+latest row versions of its embedded users, reported by user_service.
+"""
+
+import functools
+import json
+import time
+from datetime import datetime
+from typing import Callable, Dict, Iterable
+from urllib.parse import urlencode
+
+from flask import current_app, request
+from redis import RedisError
+
+from . import redis_store
+
+# Bumped by user_service as well, so keep it in sync with user_service
+GENERATION_KEY = 'post_cache:generation'
+LIST_VERSION_KEY = 'post_cache:list_version'
+POST_VERSION_KEY = 'post_cache:post_version:{}'
+# Set by user_service as well, so keep it in sync with user_service
+USER_VERSION_KEY = 'post_cache:user_version:{}'
+STATS_KEY = 'post_cache:stats'
+
+
+def cached_response(f: Callable) -> Callable:
+    """
+    Decorator to cache the successful responses of the decorated resource "get"
+    method, keyed by the request path and query arguments, and versioned by the
+    post ID if any.
+    :param f: Callable
+    :return: Callable
+    """
+    @functools.wraps(f)
+    def wrapper(*args, **kwargs):
+        try:
+            key = _get_cache_key(kwargs.get('id', kwargs.get('post_id')))
+            cached = redis_store.get(key)
+            entry = None
+            if cached:
+                entry = json.loads(cached, object_hook=_decode_datetime)
+                if _has_outdated_users(entry['body']):
+                    entry = None
+        except RedisError:
+            current_app.logger.exception('Response cache unavailable')
+            return f(*args, **kwargs)
+
+        if entry:
+            _record_hit(time.time() - entry['stored_at'])
+            return entry['body'], 200
+        _record_miss()
+
+        result = f(*args, **kwargs)
+        if isinstance(result, tuple):
+            body, status = result[0], result[1]
+        else:
+            body, status = result, 200
+        if status == 200:
+            entry = {
+                'stored_at': time.time(),
+                'body': body
+            }
+            try:
+                redis_store.set(
+                    key,
+                    json.dumps(entry, default=_encode_datetime),
+                    ex=current_app.config['RESPONSE_CACHE_TTL']
+                )
+            except RedisError:
+                current_app.logger.exception('Response cache unavailable')
+        return result
+    return wrapper
+
+
+def _encode_datetime(value):
+    """
+    Private helper function to encode the datetimes in the cached bodies, so
+    that they are restored as datetimes, to be encoded natively by the
+    representations.
+    :param value:
+    :return: dict
+    """
+    if isinstance(value, datetime):
+        return {'$datetime': value.isoformat()}
+    raise TypeError(f'{type(value).__name__} is not JSON serializable')
+
+
+def _decode_datetime(obj: dict):
+    """
+    Private helper function to restore the datetimes encoded by
+    _encode_datetime().
+    :param obj: dict
+    :return:
+    """
+    if obj.keys() == {'$datetime'}:
+        return datetime.fromisoformat(obj['$datetime'])
+    return obj
+
+
+def _get_cache_key(post_id: int=None) -> str:
+    """
+    Private helper function to get the cache key of the current request, from
+    the current versions.
+    :param post_id: int
+    :return: str
+    """
+    args = urlencode(sorted(request.args.items(multi=True)))
+    if post_id is None:
+        generation, list_version = redis_store.mget(
+            GENERATION_KEY, LIST_VERSION_KEY
+        )
+        return f'post_cache:list:{generation or 0}:{list_version or 0}:{request.path}?{args}'
+    generation, post_version = redis_store.mget(
+        GENERATION_KEY, POST_VERSION_KEY.format(post_id)
+    )
+    return f'post_cache:post:{generation or 0}:{post_version or 0}:{request.path}?{args}'
+
+
+def _get_embedded_user_versions(body: dict) -> Dict[int, int]:
+    """
+    Private helper function to get the row versions of the users embedded in
+    the given response body, i.e., the authors of the posts, and the user of a
+    listing of posts.
+    :param body: dict
+    :return: dict{int: int}
+    """
+    data = body.get('data')
+    if not isinstance(data, dict):
+        return {}
+    posts = data['posts'] if 'posts' in data else [data]
+    users = [post['author'] for post in posts if post.get('author')]
+    if data.get('user_data'):
+        users.append(data['user_data'])
+    return {user['id']: user['version'] for user in users}
+
+
+def _has_outdated_users(body: dict) -> bool:
+    """
+    Private helper function to check whether any user embedded in the given
+    cached response body has changed since.
+    :param body: dict
+    :return: bool
+    """
+    user_versions = _get_embedded_user_versions(body)
+    if not user_versions:
+        return False
+    user_ids = list(user_versions)
+    latest_versions = redis_store.mget(
+        [USER_VERSION_KEY.format(user_id) for user_id in user_ids]
+    )
+    return any(
+        latest is not None and int(latest) > user_versions[user_id]
+        for user_id, latest in zip(user_ids, latest_versions)
+    )
+
+
+def get_generation() -> int:
+    """
+    Gets the current generation of the cache, which changes whenever the user
+    data embedded in the posts changes.
+    :return: int
+    """
+    return int(redis_store.get(GENERATION_KEY) or 0)
+
+
+def _record_hit(age: float) -> None:
+    """
+    Private helper function to record a cache hit, serving an entry of the
+    given age.
+    :param age: float
+    :return: None
+    """
+    pipe = redis_store.pipeline(transaction=False)
+    pipe.hincrby(STATS_KEY, 'hits', 1)
+    pipe.hincrbyfloat(STATS_KEY, 'served_age_sum', age)
+    try:
+        pipe.execute()
+    except RedisError:  # Statistics only, not worth failing the request
+        current_app.logger.exception('Failed to record a cache hit')
+
+
+def _record_miss() -> None:
+    """
+    Private helper function to record a cache miss.
+    :return: None
+    """
+    try:
+        redis_store.hincrby(STATS_KEY, 'misses', 1)
+    except RedisError:  # Statistics only, not worth failing the request
+        current_app.logger.exception('Failed to record a cache miss')
+
+
+def invalidate_post_lists() -> None:
+    """
+    Invalidates all the cached listings of posts.
+    :return: None
+    """
+    try:
+        redis_store.incr(LIST_VERSION_KEY)
+    except RedisError:
+        current_app.logger.exception('Failed to invalidate the post listings')
+
+
+def invalidate_posts(post_ids: Iterable[int]) -> None:
+    """
+    Invalidates the cached responses of the given posts, as well as all the
+    cached listings of posts.
+    :param post_ids: iterable[int]
+    :return: None
+    """
+    pipe = redis_store.pipeline(transaction=False)
+    for post_id in post_ids:
+        pipe.incr(POST_VERSION_KEY.format(post_id))
+    pipe.incr(LIST_VERSION_KEY)
+    try:
+        pipe.execute()
+    except RedisError:
+        current_app.logger.exception('Failed to invalidate the posts')
+
+
+def get_cache_stats() -> dict:
+    """
+    Gets the statistics of the response cache.
+    Since the writes make the affected entries unreachable synchronously, the
+    mean age of the served entries shows how old the cache hits really are.
+    :return: dict
+    """
+    stats = redis_store.hgetall(STATS_KEY)
+    hits = int(stats.get('hits', 0))
+    misses = int(stats.get('misses', 0))
+    lookups = hits + misses
+    return {
+        'hits': hits,
+        'misses': misses,
+        'hit_ratio': hits / lookups if lookups else 0.0,
+        'mean_served_age_seconds':
+            float(stats.get('served_age_sum', 0)) / hits if hits else 0.0
+    }
@@ -0,0 +1,70 @@
+# -*- coding: utf-8 -*-
+
+"""
+Flask CLI commands module.
+"""
+
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+from sqlalchemy.dialects.postgresql import insert
+
+from . import db
+from .counts import reset_post_counters
+from .likes import flush_likes
+from .models import Post, User, following, timeline
+
+
+@click.command('rebuild-timelines')
+@with_appcontext
+def rebuild_timelines_command() -> None:
+    """
+    Rebuilds the home timelines from the existing posts and following
+    relationships, e.g., for the posts created before fan-out-on-write.
+    The posts of the authors with too many followers are skipped, since they
+    are merged at read time anyway.
+    :return: None
+    """
+    columns = ['owner_id', 'post_id', 'author_id', 'date_posted']
+    own_posts = db.select([Post.user_id, Post.id, Post.user_id, Post.date_posted])
+    db.session.execute(
+        insert(timeline).from_select(columns, own_posts).on_conflict_do_nothing()
+    )
+
+    max_followers = current_app.config['TIMELINE_FANOUT_MAX_FOLLOWERS']
+    followed_posts = db.select([
+        following.c.follower_id, Post.id, Post.user_id, Post.date_posted
+    ]).select_from(
+        following
+        .join(Post, Post.user_id == following.c.followed_id)
+        .join(User, User.id == following.c.followed_id)
+    ).where(User.follower_count <= max_followers)
+    db.session.execute(
+        insert(timeline).from_select(columns, followed_posts)
+        .on_conflict_do_nothing()
+    )
+    db.session.commit()
+    click.echo('Home timelines rebuilt.')
+
+
+@click.command('flush-likes')
+@with_appcontext
+def flush_likes_command() -> None:
+    """
+    Folds the pending likes in Redis into the database right away.
+    :return: None
+    """
+    flushed = flush_likes()
+    click.echo(f'Flushed the pending likes of {flushed} posts.')
+
+
+@click.command('reset-post-counters')
+@with_appcontext
+def reset_post_counters_command() -> None:
+    """
+    Resets the maintained post counters, which are then re-seeded from the
+    database on next use.
+    :return: None
+    """
+    reset_post_counters()
+    click.echo('Post counters reset.')
@@ -22,3 +22,28 @@ class Config:
     postgres_db = 'flask_blog'
     SQLALCHEMY_DATABASE_URI = f'postgres://{postgres_user}:{postgres_password}@{postgres_hostname}/{postgres_db}'
     SQLALCHEMY_TRACK_MODIFICATIONS = False
+
+    # Redis, shared with the Celery broker of "flask_app" on another database
+    REDIS_URL = os.environ.get('REDIS_URL', 'redis://redis:6379/2')
+
+    # TTL (in seconds) of the cached responses of the read endpoints
+    RESPONSE_CACHE_TTL = int(os.environ.get('RESPONSE_CACHE_TTL', 300))
+
+    # TTL (in seconds) of the cached post counts of the listings which can't be
+    # counted by maintained counters, e.g., the home timelines
+    POST_COUNT_CACHE_TTL = int(os.environ.get('POST_COUNT_CACHE_TTL', 60))
+
+    # Interval (in seconds) at which the pending likes in Redis are folded into
+    # "posts.likes". Set to 0 to disable the flusher in this process.
+    LIKES_FLUSH_INTERVAL = float(os.environ.get('LIKES_FLUSH_INTERVAL', 5))
+
+    # Home timeline fan-out: the posts of authors with more followers than this
+    # are not pushed to every follower's timeline, but merged at read time.
+    TIMELINE_FANOUT_MAX_FOLLOWERS = int(
+        os.environ.get('TIMELINE_FANOUT_MAX_FOLLOWERS', 10000)
+    )
+
+    # Number of comments returned with a post, and by default per page of
+    # "GET /posts/<id>/comments", as well as the maximum per page
+    COMMENTS_PER_PAGE = int(os.environ.get('COMMENTS_PER_PAGE', 10))
+    COMMENTS_MAX_PER_PAGE = int(os.environ.get('COMMENTS_MAX_PER_PAGE', 50))
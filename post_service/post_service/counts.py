@@ -0,0 +1,224 @@
+# -*- coding: utf-8 -*-
+
+"""
+Post counting strategies module, for the total numbers of posts reported in the
+pagination metadata.
+
+- EXACT: COUNT(*) over the listing on every request
+- CACHED: COUNT(*) over the listing, cached in Redis with a TTL
+- COUNTER: Counters in Redis maintained on post creation and deletion, globally
+  and per author, seeded by COUNT(*) on first use
+  Since the counters are adjusted after the write commits, a write marks itself
+  in flight before committing, and a seed is only stored if no write has been
+  in flight since it started counting; otherwise its COUNT(*) may or may not
+  include a write whose adjustment is still to come.
+- ESTIMATE: The planner's estimate, from "pg_class" for the whole table, or
+  from EXPLAIN for any other listing
+If Redis is unavailable, CACHED and COUNTER fall back to EXACT.
+"""
+
+import json
+import time
+import uuid
+from typing import Optional, Tuple
+
+from flask import current_app
+from flask_sqlalchemy import BaseQuery
+from redis import RedisError
+
+from . import db, redis_store
+
+EXACT = 'exact'
+CACHED = 'cached'
+COUNTER = 'counter'
+ESTIMATE = 'estimate'
+
+COUNTERS_KEY = 'post_counts:counters'
+# Bumped by every adjustment of the counters
+COUNTERS_EPOCH_KEY = 'post_counts:epoch'
+# The writes in flight, i.e., committing but not adjusted yet, by their start
+# time
+COUNTER_WRITES_KEY = 'post_counts:writes'
+# After which a write in flight is assumed to have died before adjusting
+COUNTER_WRITE_TIMEOUT = 60
+CACHED_COUNT_KEY = 'post_counts:cached:{}'
+GLOBAL_COUNTER = 'all'
+AUTHOR_COUNTER = 'author:{}'
+
+# Adjusts the seeded counters of a committed write, and ends the write; a
+# missing counter is left to be seeded, which can't have been stored while the
+# write was in flight. A write which took too long may have been counted by a
+# seed already, so the counters are reset instead.
+_ADJUST_COUNTERS_SCRIPT = """
+local started = redis.call('ZSCORE', KEYS[3], ARGV[1])
+if started and tonumber(started) >= tonumber(ARGV[3]) then
+    for i = 4, #ARGV do
+        if redis.call('HEXISTS', KEYS[1], ARGV[i]) == 1 then
+            redis.call('HINCRBY', KEYS[1], ARGV[i], ARGV[2])
+        end
+    end
+else
+    redis.call('DEL', KEYS[1])
+end
+redis.call('ZREM', KEYS[3], ARGV[1])
+redis.call('ZREMRANGEBYSCORE', KEYS[3], '-inf', '(' .. ARGV[3])
+redis.call('INCR', KEYS[2])
+"""
+
+# Stores a seed, unless a counter adjustment happened since the seed started
+# counting, or a write is still in flight.
+_SEED_COUNTER_SCRIPT = """
+if (redis.call('GET', KEYS[2]) or '0') ~= ARGV[3] then
+    return 0
+end
+if redis.call('ZCOUNT', KEYS[3], ARGV[4], '+inf') > 0 then
+    return 0
+end
+return redis.call('HSETNX', KEYS[1], ARGV[1], ARGV[2])
+"""
+
+
+def count_posts(query: BaseQuery, strategy: str,
+                key: Optional[str]=None) -> Tuple[int, bool]:
+    """
+    Counts the posts of the given listing query, using the given strategy.
+    :param query: BaseQuery
+    :param strategy: str
+    :param key: str, the counter or cache key for COUNTER and CACHED; for
+                ESTIMATE, the table to use the statistics of, or None to
+                EXPLAIN the listing
+    :return: tuple(int, bool), the total and whether it's an estimate
+    """
+    query = query.order_by(None)
+    if strategy in (CACHED, COUNTER):
+        try:
+            if strategy == CACHED:
+                return _count_cached(query, key), True
+            return _count_by_counter(query, key), False
+        except RedisError:
+            current_app.logger.exception('Post counters unavailable')
+            return query.count(), False
+    if strategy == ESTIMATE:
+        if key is None:
+            total = _explain_rows(query)
+        else:
+            total = db.session.execute(
+                'SELECT reltuples FROM pg_class WHERE relname = :table',
+                {'table': key}
+            ).scalar()
+        return max(int(total or 0), 0), True
+    return query.count(), False
+
+
+def _count_cached(query: BaseQuery, key: str) -> int:
+    """
+    Private helper function to count the posts of the given listing query,
+    cached under the given key.
+    :param query: BaseQuery
+    :param key: str
+    :return: int
+    """
+    cache_key = CACHED_COUNT_KEY.format(key)
+    total = redis_store.get(cache_key)
+    if total is None:
+        total = query.count()
+        redis_store.set(
+            cache_key, total, ex=current_app.config['POST_COUNT_CACHE_TTL']
+        )
+    return int(total)
+
+
+def _count_by_counter(query: BaseQuery, key: str) -> int:
+    """
+    Private helper function to count the posts of the given listing query by
+    the given counter, seeding it if missing.
+    :param query: BaseQuery
+    :param key: str
+    :return: int
+    """
+    total = redis_store.hget(COUNTERS_KEY, key)
+    if total is not None:
+        return int(total)
+    epoch = redis_store.get(COUNTERS_EPOCH_KEY) or '0'
+    total = query.count()
+    redis_store.register_script(_SEED_COUNTER_SCRIPT)(
+        keys=[COUNTERS_KEY, COUNTERS_EPOCH_KEY, COUNTER_WRITES_KEY],
+        args=[key, total, epoch, time.time() - COUNTER_WRITE_TIMEOUT]
+    )
+    return total
+
+
+def _explain_rows(query: BaseQuery) -> int:
+    """
+    Private helper function to get the planner's estimated number of rows of
+    the given query.
+    :param query: BaseQuery
+    :return: int
+    """
+    compiled = query.statement.compile(dialect=db.engine.dialect)
+    # Executed as a plain DBAPI string, so that the compiled parameters are
+    # bound by the driver.
+    plan = db.session.connection().execute(
+        f'EXPLAIN (FORMAT JSON) {compiled}', compiled.params
+    ).scalar()
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    return plan[0]['Plan']['Plan Rows']
+
+
+def begin_post_counter_write() -> Optional[str]:
+    """
+    Marks a post creation or deletion in flight, before committing it, so that
+    no counter is seeded until its adjustment.
+    :return: str or None, the token of the write to pass to
+             adjust_post_counters(), or None if Redis is unavailable
+    """
+    token = uuid.uuid4().hex
+    try:
+        redis_store.zadd(COUNTER_WRITES_KEY, {token: time.time()})
+    except RedisError:
+        current_app.logger.exception('Post counters unavailable')
+        return None
+    return token
+
+
+def adjust_post_counters(token: Optional[str], author_id: int,
+                         delta: int) -> None:
+    """
+    Adjusts the global and the given author's post counters by the given delta,
+    if they have been seeded, after the write with the given token committed.
+    If the write couldn't be marked, or the adjustment fails, the counters are
+    reset instead, so that they are re-seeded from the database.
+    :param token: str or None
+    :param author_id: int
+    :param delta: int
+    :return: None
+    """
+    if token is not None:
+        try:
+            redis_store.register_script(_ADJUST_COUNTERS_SCRIPT)(
+                keys=[COUNTERS_KEY, COUNTERS_EPOCH_KEY, COUNTER_WRITES_KEY],
+                args=[
+                    token, delta, time.time() - COUNTER_WRITE_TIMEOUT,
+                    GLOBAL_COUNTER, AUTHOR_COUNTER.format(author_id)
+                ]
+            )
+            return
+        except RedisError:
+            current_app.logger.exception('Failed to adjust the post counters')
+    try:
+        reset_post_counters()
+    except RedisError:
+        current_app.logger.exception('Failed to reset the post counters')
+
+
+def reset_post_counters() -> None:
+    """
+    Resets all the post counters, so that they are re-seeded from the
+    database on next use.
+    :return: None
+    """
+    pipe = redis_store.pipeline()
+    pipe.delete(COUNTERS_KEY)
+    pipe.incr(COUNTERS_EPOCH_KEY)  # Discard the seeds counted before
+    pipe.execute()
@@ -0,0 +1,199 @@
+# -*- coding: utf-8 -*-
+
+"""
+Write-behind post like counter module.
+
+Likes are counted in a Redis hash instead of updating "posts.likes" for each of
+them, which would serialize all the likes of a hot post on its row lock.
+A periodic flusher folds the pending deltas into "posts.likes" in batches, and
+reads add the pending deltas on top of the stored counts.
+"""
+
+import functools
+import uuid
+from datetime import datetime, timedelta
+from typing import Callable, Dict, Iterable, List
+
+import gevent
+from flask import Flask, current_app
+from redis import RedisError
+from sqlalchemy.dialects.postgresql import insert
+
+from . import db, redis_store
+from .cache import invalidate_posts
+from .models import like_flushes
+
+PENDING_LIKES_KEY = 'post_likes:pending'
+# The deltas being folded into the database by the flusher
+FLUSHING_LIKES_KEY = 'post_likes:flushing'
+# The ID of the batch of deltas being folded
+FLUSH_BATCH_KEY = 'post_likes:flush_batch'
+FLUSH_LOCK_KEY = 'post_likes:flush_lock'
+
+
+def add_like(post_id: int) -> int:
+    """
+    Adds a like to the given post.
+    :param post_id: int
+    :return: int
+    """
+    return redis_store.hincrby(PENDING_LIKES_KEY, post_id, 1)
+
+
+def get_pending_likes(post_ids: Iterable[int]) -> Dict[int, int]:
+    """
+    Gets the likes of the given posts that haven't been folded into the
+    database yet.
+    If Redis is unavailable, there are considered to be none, so that the
+    reads still work, with the likes as of the last flush.
+    :param post_ids: iterable[int]
+    :return: dict{int: int}
+    """
+    post_ids = list(post_ids)
+    if not post_ids:
+        return {}
+    pipe = redis_store.pipeline(transaction=False)
+    pipe.hmget(PENDING_LIKES_KEY, post_ids)
+    pipe.hmget(FLUSHING_LIKES_KEY, post_ids)
+    try:
+        pending, flushing = pipe.execute()
+    except RedisError:
+        current_app.logger.exception('Pending likes unavailable')
+        return {post_id: 0 for post_id in post_ids}
+    return {
+        post_id: int(p or 0) + int(f or 0)
+        for post_id, p, f in zip(post_ids, pending, flushing)
+    }
+
+
+def merge_pending_likes(posts_data: List[dict]) -> None:
+    """
+    Adds the pending likes to the given serialized posts in-place.
+    :param posts_data: list[dict]
+    :return: None
+    """
+    pending_likes = get_pending_likes(post['id'] for post in posts_data)
+    for post in posts_data:
+        post['likes'] += pending_likes[post['id']]
+
+
+def with_pending_likes(f: Callable) -> Callable:
+    """
+    Decorator to add the pending likes to the post(s) in the response of the
+    decorated resource method.
+    :param f: Callable
+    :return: Callable
+    """
+    @functools.wraps(f)
+    def wrapper(*args, **kwargs):
+        result = f(*args, **kwargs)
+        if isinstance(result, tuple):
+            body, status = result[0], result[1]
+        else:
+            body, status = result, 200
+        if status in (200, 201):
+            data = body['data']
+            merge_pending_likes(data['posts'] if 'posts' in data else [data])
+        return result
+    return wrapper
+
+
+def flush_likes() -> int:
+    """
+    Folds the pending likes into "posts.likes" in a single batched UPDATE.
+    Only one flusher runs at a time across all the processes. If a previous
+    flush failed halfway, its deltas are retried first; the batch ID recorded
+    along with the UPDATE makes sure that they are only applied once.
+    :return: int
+    """
+    lock = redis_store.lock(FLUSH_LOCK_KEY, timeout=60, blocking_timeout=0)
+    if not lock.acquire(blocking=False):
+        return 0
+    try:
+        if not redis_store.exists(FLUSHING_LIKES_KEY):
+            if not redis_store.exists(PENDING_LIKES_KEY):
+                return 0
+            # Atomically take the current deltas away from the likers, as a new
+            # batch
+            pipe = redis_store.pipeline()
+            pipe.rename(PENDING_LIKES_KEY, FLUSHING_LIKES_KEY)
+            pipe.set(FLUSH_BATCH_KEY, uuid.uuid4().hex)
+            pipe.execute()
+        else:  # Retrying a failed batch, with its ID if it has one already
+            redis_store.set(FLUSH_BATCH_KEY, uuid.uuid4().hex, nx=True)
+        batch_id = redis_store.get(FLUSH_BATCH_KEY)
+
+        deltas = redis_store.hgetall(FLUSHING_LIKES_KEY)
+        applied = bool(deltas) and _apply_like_deltas(batch_id, deltas)
+        # Hand the batch off before invalidating, so that the readers stop
+        # adding its deltas on top of the stored counts as soon as possible
+        redis_store.delete(FLUSHING_LIKES_KEY, FLUSH_BATCH_KEY)
+        if applied:
+            invalidate_posts(int(post_id) for post_id in deltas)
+        return len(deltas)
+    finally:
+        lock.release()
+
+
+def _apply_like_deltas(batch_id: str, deltas: dict) -> bool:
+    """
+    Private helper function to fold the given batch of like deltas into
+    "posts.likes", unless the batch has already been folded.
+    :param batch_id: str
+    :param deltas: dict{str: str}
+    :return: bool, whether the batch has been folded now
+    """
+    # Forget the batches old enough not to be retried any more
+    db.session.execute(like_flushes.delete().where(
+        like_flushes.c.applied_at < datetime.utcnow() - timedelta(days=1)
+    ))
+    result = db.session.execute(
+        insert(like_flushes).values(batch_id=batch_id).on_conflict_do_nothing()
+    )
+    if result.rowcount == 0:  # Already folded before the hand-off failed
+        db.session.rollback()
+        return False
+    db.session.execute(
+        db.text(
+            'UPDATE posts '
+            'SET likes = posts.likes + deltas.delta, '
+            'version = posts.version + 1 '
+            'FROM unnest(:ids, :deltas) AS deltas(id, delta) '
+            'WHERE posts.id = deltas.id'
+        ),
+        {
+            'ids': [int(post_id) for post_id in deltas],
+            'deltas': [int(delta) for delta in deltas.values()]
+        }
+    )
+    db.session.commit()
+    return True
+
+
+def start_likes_flusher(app: Flask) -> None:
+    """
+    Starts a background greenlet periodically flushing the pending likes, if
+    enabled by "LIKES_FLUSH_INTERVAL".
+    :param app: Flask
+    :return: None
+    """
+    interval = app.config['LIKES_FLUSH_INTERVAL']
+    if interval > 0:
+        gevent.spawn(_flush_periodically, app, interval)
+
+
+def _flush_periodically(app: Flask, interval: float) -> None:
+    """
+    Private helper function to flush the pending likes every given interval.
+    :param app: Flask
+    :param interval: float
+    :return: None
+    """
+    while True:
+        gevent.sleep(interval)
+        with app.app_context():
+            try:
+                flush_likes()
+            except Exception:
+                db.session.rollback()
+                app.logger.exception('Failed to flush the pending likes')
@@ -13,10 +13,83 @@ from . import db, ma
 ##### MODELS #####
 
 
+# The primary key makes following someone twice impossible. The two indices
+# back the newest-first (created_at, user ID) keyset pagination of whom a user
+# follows, and of who follows a user.
 following = db.Table(
     'following',
-    db.Column('follower_id', db.Integer, db.ForeignKey('users.id')),
-    db.Column('followed_id', db.Integer, db.ForeignKey('users.id'))
+    db.Column(
+        'follower_id',
+        db.Integer,
+        db.ForeignKey('users.id', ondelete='CASCADE'),
+        primary_key=True
+    ),
+    db.Column(
+        'followed_id',
+        db.Integer,
+        db.ForeignKey('users.id', ondelete='CASCADE'),
+        primary_key=True
+    ),
+    db.Column(
+        'created_at', db.DateTime, nullable=False, default=datetime.utcnow
+    ),
+    db.Index(
+        'ix_following_follower_id_created_at_followed_id',
+        'follower_id',
+        'created_at',
+        'followed_id'
+    ),
+    db.Index(
+        'ix_following_followed_id_created_at_follower_id',
+        'followed_id',
+        'created_at',
+        'follower_id'
+    )
+)
+
+
+# Materialized home timeline: one row per (reader, post), pushed when the post is
+# created (fan-out-on-write), so that reading the followed posts of a user is a
+# single range scan on (owner_id, date_posted, post_id).
+timeline = db.Table(
+    'timeline',
+    db.Column(
+        'owner_id',
+        db.Integer,
+        db.ForeignKey('users.id', ondelete='CASCADE'),
+        primary_key=True
+    ),
+    db.Column(
+        'post_id',
+        db.Integer,
+        db.ForeignKey('posts.id', ondelete='CASCADE'),
+        primary_key=True
+    ),
+    db.Column('author_id', db.Integer, nullable=False),
+    db.Column('date_posted', db.DateTime, nullable=False),
+    db.Index(
+        'ix_timeline_owner_id_date_posted_post_id',
+        'owner_id',
+        'date_posted',
+        'post_id'
+    ),
+    # Backs the cascading deletes of the entries of a deleted post, which
+    # would otherwise scan the whole table.
+    # On an existing database, create it with
+    # CREATE INDEX CONCURRENTLY ix_timeline_post_id ON timeline (post_id);
+    db.Index('ix_timeline_post_id', 'post_id')
+)
+
+
+# The batches of pending post likes already folded into "posts.likes", recorded
+# in the same transaction as the fold, so that a batch retried after a failed
+# hand-off in Redis is never applied twice
+like_flushes = db.Table(
+    'like_flushes',
+    db.Column('batch_id', db.String(32), primary_key=True),
+    db.Column(
+        'applied_at', db.DateTime, nullable=False, default=datetime.utcnow
+    )
 )
 
 
@@ -37,6 +110,19 @@ class User(db.Model):
 
     from_oauth = db.Column(db.Boolean, nullable=False, default=False)
     image_filename = db.Column(db.String(255), default='default.jpg')
+    # Denormalized counts of the following relationships, so that serializing a
+    # user doesn't need to count them
+    follower_count = db.Column(
+        db.Integer, nullable=False, default=0, server_default='0'
+    )
+    following_count = db.Column(
+        db.Integer, nullable=False, default=0, server_default='0'
+    )
+    # Row version, incremented on every update, from which the ETags are derived.
+    # Not an ORM version counter, since most updates are bulk statements bumping
+    # it themselves, which would make the concurrent ORM updates fail their
+    # version check; so the ORM updates bump it explicitly as well.
+    version = db.Column(db.Integer, nullable=False, server_default='1')
 
     posts = db.relationship(
         'Post', lazy='dynamic', cascade='all, delete-orphan', backref='author'
@@ -88,6 +174,10 @@ class Post(db.Model):
     Post table.
     """
     __tablename__ = 'posts'
+    __table_args__ = (
+        db.Index('ix_posts_date_posted_id', 'date_posted', 'id'),
+        db.Index('ix_posts_user_id_date_posted_id', 'user_id', 'date_posted', 'id'),
+    )  # Back the (date_posted, id) keyset pagination, globally and per author.
 
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(
@@ -101,9 +191,14 @@ class Post(db.Model):
         db.DateTime, nullable=False, default=datetime.utcnow
     )
     likes = db.Column(db.Integer, nullable=False, default=0)
+    # Row version, incremented on every update, from which the ETags are derived.
+    # Not an ORM version counter, since most updates are bulk statements bumping
+    # it themselves, which would make the concurrent ORM updates fail their
+    # version check; so the ORM updates bump it explicitly as well.
+    version = db.Column(db.Integer, nullable=False, server_default='1')
     comments = db.relationship(
-        'Comment', lazy=False, cascade='all, delete-orphan', backref='post'
-    )  # Post.comments is eager-loading.
+        'Comment', lazy=True, cascade='all, delete-orphan', backref='post'
+    )  # Post.comments is lazy-loading, so that listing posts doesn't load them.
 
 
 class Comment(db.Model):
@@ -111,6 +206,11 @@ class Comment(db.Model):
     Comment table.
     """
     __tablename__ = 'comments'
+    __table_args__ = (
+        db.Index(
+            'ix_comments_post_id_date_posted_id', 'post_id', 'date_posted', 'id'
+        ),
+    )  # Back the (date_posted, id) keyset pagination of the comments of a post.
 
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(
@@ -129,6 +229,25 @@ class Comment(db.Model):
     )
 
 
+# Defined after "Comment", which it counts
+Post.comment_count = db.column_property(
+    db.select([db.func.count(Comment.id)])
+    .where(Comment.post_id == Post.id)
+    .correlate_except(Comment)
+)  # Counted with the post in the same query, using the index on comments.
+
+
+# Full-text search document of a post, over its title and content.
+# PostgreSQL 9.6 doesn't support generated columns, so it's backed by a GIN
+# expression index instead, which the queries using the same expression hit.
+SEARCH_CONFIG = 'english'
+post_search_vector = db.func.to_tsvector(
+    db.literal_column(f"'{SEARCH_CONFIG}'"),
+    Post.title + db.literal_column("' '") + Post.content
+)
+db.Index('ix_posts_search_vector', post_search_vector, postgresql_using='gin')
+
+
 ##### SCHEMAS #####
 # Note!!!!!
 # The data validation is done in the upstream "flask_blog_app" on form level, so
@@ -136,6 +255,17 @@ class Comment(db.Model):
 # is only used for data serialization.
 
 
+class NativeDateTime(fields.DateTime):
+    """
+    DateTime field dumping the datetimes as they are, so that each
+    representation encodes them natively; check out the "representations"
+    module.
+    """
+
+    def _serialize(self, value, attr, obj, **kwargs):
+        return value
+
+
 class UserSchema(ma.Schema):
     """
     User schema.
@@ -147,32 +277,9 @@ class UserSchema(ma.Schema):
     password = fields.Str(required=True, load_only=True)
     from_oauth = fields.Boolean()
     image_filename = fields.Str()
-    following_count = fields.Method(
-        serialize='_get_following_count', dump_only=True
-    )
-    follower_count = fields.Method(
-        serialize='_get_follower_count', dump_only=True
-    )
-
-    def _get_following_count(self, obj: User) -> int:
-        """
-        Returns the number of following users of the given user.
-        :param obj: User
-        :return: int
-        """
-        if not obj:
-            return 0
-        return obj.following.count()
-
-    def _get_follower_count(self, obj: User) -> int:
-        """
-        Returns the number of followers of the given user.
-        :param obj: User
-        :return: int
-        """
-        if not obj:
-            return 0
-        return obj.followers.count()
+    following_count = fields.Int(dump_only=True)
+    follower_count = fields.Int(dump_only=True)
+    version = fields.Int(dump_only=True)
 
     class Meta:
         unknown = EXCLUDE
@@ -196,15 +303,18 @@ class PostSchema(ma.Schema):
                 'from_oauth',
                 'image_filename',
                 'following_count',
-                'follower_count'
+                'follower_count',
+                'version'
             )
         ),
         required=True
     )
     title = fields.Str(required=True)
     content = fields.Str(required=True)
-    date_posted = fields.DateTime(dump_only=True)
+    date_posted = NativeDateTime(dump_only=True)
     likes = fields.Int(default=0)
+    version = fields.Int(dump_only=True)
+    comment_count = fields.Int(dump_only=True)
     comments = fields.List(fields.Nested('CommentSchema'))
 
     class Meta:
@@ -213,6 +323,12 @@ class PostSchema(ma.Schema):
 
 post_schema = PostSchema()
 posts_schema = PostSchema(many=True)
+# Summary projection without the comments, for listing posts and for responses
+# to writes
+post_summary_schema = PostSchema(exclude=('comments',))
+post_summaries_schema = PostSchema(many=True, exclude=('comments',))
+# Projection of the "posts" columns only, for the rows returned by the writes
+post_row_schema = PostSchema(exclude=('author', 'comments', 'comment_count'))
 
 
 class CommentSchema(ma.Schema):
@@ -223,7 +339,7 @@ class CommentSchema(ma.Schema):
     id = fields.Int(dump_only=True)
     author_name = fields.Method('_get_author_name', dump_only=True)
     text = fields.Str(required=True)
-    date_posted = fields.DateTime(dump_only=True)
+    date_posted = NativeDateTime(dump_only=True)
     post_author_email = fields.Method('_get_post_author_email', dump_only=True)
 
     def _get_author_name(self, obj: Comment) -> str:
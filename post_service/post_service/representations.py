@@ -0,0 +1,89 @@
+# -*- coding: utf-8 -*-
+
+"""
+Response representations module.
+
+The responses are negotiated by the "Accept" header between JSON, the default,
+and MessagePack, which is more compact and cheaper to encode and decode, and
+carries the datetimes as native timestamps rather than ISO 8601 strings.
+The resources return the datetimes as they are, and leave their encoding to
+the representations.
+"""
+
+import json
+from datetime import datetime, timezone
+
+import msgpack
+from flask import make_response
+from flask_restful import Api
+
+JSON = 'application/json'
+MSGPACK = 'application/msgpack'
+
+
+def _json_default(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    raise TypeError(f'{type(value).__name__} is not JSON serializable')
+
+
+def _msgpack_default(value):
+    if isinstance(value, datetime):
+        if value.tzinfo is None:  # Stored in UTC
+            value = value.replace(tzinfo=timezone.utc)
+        return msgpack.Timestamp.from_datetime(value)
+    raise TypeError(f'{type(value).__name__} is not MessagePack serializable')
+
+
+def dumps_json(data) -> str:
+    """
+    Encodes the given data into JSON.
+    :param data:
+    :return: str
+    """
+    return json.dumps(data, default=_json_default)
+
+
+def dumps_msgpack(data) -> bytes:
+    """
+    Encodes the given data into MessagePack.
+    :param data:
+    :return: bytes
+    """
+    return msgpack.packb(data, default=_msgpack_default, use_bin_type=True)
+
+
+def output_json(data, code: int, headers: dict=None):
+    """
+    JSON representation.
+    :param data:
+    :param code: int
+    :param headers: dict
+    :return:
+    """
+    resp = make_response(dumps_json(data) + '\n', code)
+    resp.headers.extend(headers or {})
+    return resp
+
+
+def output_msgpack(data, code: int, headers: dict=None):
+    """
+    MessagePack representation.
+    :param data:
+    :param code: int
+    :param headers: dict
+    :return:
+    """
+    resp = make_response(dumps_msgpack(data), code)
+    resp.headers.extend(headers or {})
+    return resp
+
+
+def register_representations(api: Api) -> None:
+    """
+    Registers the representations on the given API, JSON being the default.
+    :param api: Api
+    :return: None
+    """
+    api.representation(JSON)(output_json)
+    api.representation(MSGPACK)(output_msgpack)
@@ -4,13 +4,134 @@
 Post-related RESTful API module.
 """
 
+from typing import Optional, Tuple
+
 import requests
-from flask import request
+from flask import current_app, request
 from flask_restful import Resource
+from sqlalchemy.dialects.postgresql import insert
 
 from .. import db
-from ..models import Comment, Post, User, following, post_schema, posts_schema, user_schema
-from ..utils import USER_SERVICE, paginate
+from ..cache import cached_response, get_cache_stats, get_generation, invalidate_post_lists, invalidate_posts
+from ..counts import AUTHOR_COUNTER, CACHED, COUNTER, ESTIMATE, GLOBAL_COUNTER, adjust_post_counters, begin_post_counter_write
+from ..likes import add_like, get_pending_likes, with_pending_likes
+from ..models import SEARCH_CONFIG, Comment, Post, User, comments_schema, following, post_row_schema, post_search_vector, post_summaries_schema, post_summary_schema, timeline, user_schema
+from ..utils import USER_SERVICE, Listing, conditional, decode_cursor, make_etag, next_cursor, paginate
+
+
+def _get_pulled_author_ids(user: User) -> list:
+    """
+    Private helper function to get the IDs of the users that the given user
+    follows, whose posts are not fanned out on write.
+    :param user: User
+    :return: list[int]
+    """
+    rows = db.session.query(User.id)\
+        .join(following, (User.id == following.c.followed_id))\
+        .filter(following.c.follower_id == user.id)\
+        .filter(
+            User.follower_count >
+            current_app.config['TIMELINE_FANOUT_MAX_FOLLOWERS']
+        )
+    return [user_id for user_id, in rows]
+
+
+def _fan_out(post: Post) -> None:
+    """
+    Private helper function to push the given new post to its author's home
+    timeline, as well as to the home timelines of all the followers of its
+    author, unless the author has too many followers.
+    :param post: Post
+    :return: None
+    """
+    db.session.execute(insert(timeline).values(
+        owner_id=post.user_id,
+        post_id=post.id,
+        author_id=post.user_id,
+        date_posted=post.date_posted
+    ))
+    if post.author.follower_count > \
+            current_app.config['TIMELINE_FANOUT_MAX_FOLLOWERS']:
+        return
+    followers = db.select([
+        following.c.follower_id,
+        db.literal(post.id, type_=db.Integer),
+        db.literal(post.user_id, type_=db.Integer),
+        db.literal(post.date_posted, type_=db.DateTime)
+    ]).where(following.c.followed_id == post.user_id)
+    db.session.execute(insert(timeline).from_select(
+        ['owner_id', 'post_id', 'author_id', 'date_posted'], followers
+    ).on_conflict_do_nothing())  # Tolerate duplicate following edges
+
+
+def _get_comments_page(post_id: int, after: Optional[str],
+                       limit: int) -> Tuple[list, Optional[str]]:
+    """
+    Private helper function to get a page of the comments on the given post,
+    oldest-first, after the given cursor if any.
+    :param post_id: int
+    :param after: str or None
+    :param limit: int
+    :return: tuple(list[Comment], str or None), the comments and the cursor of
+             the next page
+    :raises ValueError: if the cursor is malformed
+    """
+    query = Comment.query\
+        .options(db.joinedload(Comment.author))\
+        .filter_by(post_id=post_id)
+    if after:
+        query = query.filter(
+            db.tuple_(Comment.date_posted, Comment.id) >
+            db.tuple_(*decode_cursor(after))
+        )
+    # Served by the index on (post_id, date_posted, id)
+    comments = query.order_by(Comment.date_posted, Comment.id)\
+        .limit(limit + 1)\
+        .all()
+    has_next = len(comments) > limit
+    comments = comments[:limit]
+    return comments, next_cursor(comments, has_next)
+
+
+def _author_guard_failure(id: int):
+    """
+    Private helper function to tell why an author-guarded write to the post
+    with the given ID matched no row: either the post doesn't exist, or it's
+    not by the expected author.
+    Only run after a failed write, so that the successful writes stay a single
+    statement.
+    :param id: int
+    :return:
+    """
+    if db.session.query(Post.id).filter_by(id=id).scalar() is None:
+        return {
+            'message': 'Post not found'
+        }, 404
+    return {
+        'message': 'Only the author of the post can operate on it.'
+    }, 403
+
+
+def _get_post_etag(resource: Resource, id: int) -> Optional[str]:
+    """
+    Private helper function to get the ETag of the post with the given ID,
+    derived from its row version, its author's row version, the generation of
+    the user data embedded in it, and its pending likes.
+    :param resource: Resource
+    :param id: int
+    :return: str or None
+    """
+    row = db.session.query(Post.version, User.version)\
+        .join(User, (Post.user_id == User.id))\
+        .filter(Post.id == id)\
+        .first()
+    if row is None:
+        return None
+    version, author_version = row
+    pending_likes = get_pending_likes([id])[id]
+    return make_etag(
+        f'{id}:{version}:{author_version}:{get_generation()}:{pending_likes}'
+    )
 
 
 class PostList(Resource):
@@ -18,29 +139,70 @@ class PostList(Resource):
     Resource for a collection of posts.
     """
 
-    @paginate(posts_schema)
+    @conditional()
+    @with_pending_likes
+    @cached_response
+    @paginate(post_summaries_schema, count=COUNTER)
     def get(self):
         """
-        Returns all the posts.
+        Returns all the posts, or the posts matching the "?q=" search terms
+        ranked by relevance.
+        Paginated either by "?page=" or by "?after=<cursor>"; check out the
+        "paginate" decorator.
         :return:
         """
         # For pagination, we need to return a query that hasn't run yet.
 
+        terms = request.args.get('q')
+        if terms:  # Full-text search over the titles and contents
+            ts_query = db.func.plainto_tsquery(SEARCH_CONFIG, terms)
+            # Too expensive to count exactly for common terms, so estimated by
+            # the planner instead
+            return Listing(
+                Post.query.filter(post_search_vector.op('@@')(ts_query)),
+                rank=db.func.ts_rank(post_search_vector, ts_query),
+                count=ESTIMATE
+            )
+
         username = request.args.get('user')
         if username:  # Fetch all the posts by all the users that this user follows as well as this user himself
             user = User.query.filter_by(username=username).first()
-            followed_posts = Post.query\
-                .join(following, (Post.user_id == following.c.followed_id))\
-                .filter(following.c.follower_id == user.id)
-            own_posts = user.posts
-            return followed_posts.union(own_posts), user_schema.dump(user)
+            # The posts have been pushed to the user's home timeline on write.
+            timeline_posts = Post.query\
+                .join(timeline, (Post.id == timeline.c.post_id))\
+                .filter(timeline.c.owner_id == user.id)
+            # Except those of the followed authors with too many followers,
+            # which are pulled at read time.
+            pulled_author_ids = _get_pulled_author_ids(user)
+            # The feeds can't be counted by maintained counters, so their
+            # counts are cached for a while instead.
+            if pulled_author_ids:
+                pulled_posts = Post.query\
+                    .filter(Post.user_id.in_(pulled_author_ids))
+                return Listing(
+                    timeline_posts.union(pulled_posts),
+                    user_schema.dump(user),
+                    count=CACHED,
+                    count_key=f'feed:{user.id}'
+                )
+            return Listing(
+                timeline_posts,
+                user_schema.dump(user),
+                sort_keys=(timeline.c.date_posted, timeline.c.post_id),
+                count=CACHED,
+                count_key=f'feed:{user.id}'
+            )
 
         author_name = request.args.get('author')
         if author_name:  # Fetch all the posts by this author
             author = User.query.filter_by(username=author_name).first()
-            return author.posts, user_schema.dump(author)
+            return Listing(
+                author.posts,
+                user_schema.dump(author),
+                count_key=AUTHOR_COUNTER.format(author.id)
+            )
 
-        return Post.query
+        return Listing(Post.query, count_key=GLOBAL_COUNTER)
 
     def post(self):
         """
@@ -54,10 +216,15 @@ class PostList(Resource):
             content=post_data['content']
         )
         db.session.add(new_post)
+        db.session.flush()  # Assign the post ID
+        _fan_out(new_post)
+        counter_write = begin_post_counter_write()
         db.session.commit()
+        adjust_post_counters(counter_write, new_post.user_id, 1)
+        invalidate_post_lists()
         return {
             'status': 'success',
-            'data': post_schema.dump(new_post)
+            'data': post_summary_schema.dump(new_post)
         }, 201
 
 
@@ -66,9 +233,14 @@ class PostItem(Resource):
     Resource for a single post.
     """
 
+    @conditional(_get_post_etag)
+    @with_pending_likes
+    @cached_response
     def get(self, id: int):
         """
-        Returns the post with the given ID.
+        Returns the post with the given ID, with the first page of its
+        comments; the following pages are fetched from
+        "GET /posts/<id>/comments?after=<comments_next_cursor>".
         :param id: int
         :return:
         """
@@ -77,36 +249,71 @@ class PostItem(Resource):
             return {
                 'message': 'Post not found'
             }, 404
+        comments, comments_next_cursor = _get_comments_page(
+            id, None, current_app.config['COMMENTS_PER_PAGE']
+        )
+        post_data = post_summary_schema.dump(post)
+        post_data['comments'] = comments_schema.dump(comments)
+        post_data['comments_next_cursor'] = comments_next_cursor
         return {
             'status': 'success',
-            'data': post_schema.dump(post)
+            'data': post_data
         }
 
+    @with_pending_likes
     def put(self, id: int):
         """
-        Updates the post with the given ID.
+        Updates the post with the given ID, in a single statement.
+        If "user_id" is given, only updates the post if it's by that user.
         :param id: int
         :return:
         """
-        post = Post.query.get(id)
         json_data = request.json
-        post.title = json_data['title']
-        post.content = json_data['content']
+        posts = Post.__table__
+        stmt = posts.update()\
+            .where(posts.c.id == id)\
+            .values(
+                title=json_data['title'],
+                content=json_data['content'],
+                version=posts.c.version + 1
+            )\
+            .returning(*posts.c)
+        if json_data.get('user_id') is not None:
+            stmt = stmt.where(posts.c.user_id == json_data['user_id'])
+        row = db.session.execute(stmt).first()
+        if row is None:
+            db.session.rollback()
+            return _author_guard_failure(id)
         db.session.commit()
+        invalidate_posts([id])
         return {
             'status': 'success',
-            'data': post_schema.dump(post)
+            'data': post_row_schema.dump(row)
         }
 
     def delete(self, id: int):
         """
-        Deletes the post with the given ID.
+        Deletes the post with the given ID, in a single statement; its comments
+        and timeline entries are deleted by the database.
+        If "?user_id=" is given, only deletes the post if it's by that user.
         :param id: int
         :return:
         """
-        post = Post.query.get(id)
-        db.session.delete(post)
+        posts = Post.__table__
+        stmt = posts.delete()\
+            .where(posts.c.id == id)\
+            .returning(posts.c.user_id)
+        user_id = request.args.get('user_id', type=int)
+        if user_id is not None:
+            stmt = stmt.where(posts.c.user_id == user_id)
+        author_id = db.session.execute(stmt).scalar()
+        if author_id is None:
+            db.session.rollback()
+            return _author_guard_failure(id)
+        counter_write = begin_post_counter_write()
         db.session.commit()
+        adjust_post_counters(counter_write, author_id, -1)
+        invalidate_posts([id])
         return '', 204
 
 
@@ -115,6 +322,7 @@ class PostLike(Resource):
     Resource for a post like.
     """
 
+    @with_pending_likes
     def post(self, post_id: int):
         """
         Likes the given post.
@@ -127,11 +335,13 @@ class PostLike(Resource):
                 'message': 'Post not found'
             }, 404
 
-        post.likes += 1
-        db.session.commit()
+        # Counted in Redis, and folded into the database later in batches.
+        # The cached responses don't need to be invalidated here, since the
+        # pending likes are added on top of them, but by the flusher.
+        add_like(post_id)
         return {
             'status': 'success',
-            'data': post_schema.dump(post)
+            'data': post_summary_schema.dump(post)
         }, 201
 
 
@@ -140,6 +350,48 @@ class PostComments(Resource):
     Resource for a collection of post comments.
     """
 
+    @cached_response
+    def get(self, post_id: int):
+        """
+        Returns the comments on the given post, oldest-first, paginated by
+        "?after=<cursor>&limit=".
+        :param post_id: int
+        :return:
+        """
+        if not db.session.query(Post.id).filter_by(id=post_id).scalar():
+            return {
+                'message': 'Post not found'
+            }, 404
+
+        limit = min(
+            request.args.get(
+                'limit', type=int,
+                default=current_app.config['COMMENTS_PER_PAGE']
+            ),
+            current_app.config['COMMENTS_MAX_PER_PAGE']
+        )
+        if limit < 1:
+            return {
+                'message': 'Invalid limit'
+            }, 400
+        try:
+            comments, comments_next_cursor = _get_comments_page(
+                post_id, request.args.get('after'), limit
+            )
+        except ValueError as e:
+            return {
+                'message': str(e)
+            }, 400
+        return {
+            'status': 'success',
+            'data': comments_schema.dump(comments),
+            'pagination_meta': {
+                'limit': limit,
+                'next_cursor': comments_next_cursor
+            }
+        }
+
+    @with_pending_likes
     def post(self, post_id: int):
         """
         Comments on the given post.
@@ -159,8 +411,27 @@ class PostComments(Resource):
             text=comment_data['text']
         )
         db.session.add(new_comment)
+        Post.query.filter_by(id=post_id)\
+            .update({Post.version: Post.version + 1}, synchronize_session=False)
         db.session.commit()
+        invalidate_posts([post_id])
         return {
             'status': 'success',
-            'data': post_schema.dump(post)
+            'data': post_summary_schema.dump(post)
         }, 201
+
+
+class CacheStats(Resource):
+    """
+    Resource for the response cache statistics.
+    """
+
+    def get(self):
+        """
+        Returns the response cache statistics.
+        :return:
+        """
+        return {
+            'status': 'success',
+            'data': get_cache_stats()
+        }
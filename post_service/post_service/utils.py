@@ -4,23 +4,95 @@
 Utility functions.
 """
 
+import base64
 import functools
-from typing import Callable
+import hashlib
+import json
+import math
+from datetime import datetime
+from typing import Callable, NamedTuple, Optional, Tuple, Union
 
 from flask import request
 from flask_marshmallow import Schema
+from flask_sqlalchemy import BaseQuery
+from sqlalchemy.sql import ColumnElement
 
-from .models import Post
+from . import db
+from .counts import EXACT, count_posts
+from .models import Comment, Post
 
 USER_SERVICE = 'http://user_service:8000'
 
+# Posts are always listed newest-first, with the post ID as the tie-breaker, so
+# that (date_posted, id) uniquely identifies a position in the listing.
+POST_SORT_KEYS = (Post.date_posted, Post.id)
 
-def paginate(collection_schema: Schema, max_per_page: int=10) -> Callable:
+
+class Listing(NamedTuple):
+    """
+    A not-yet-run query of posts to paginate, with the user data to return
+    alongside.
+    "sort_keys" are the columns to order and seek on, which must correspond to
+    the (date_posted, id) of the posts, e.g., those of the timeline rows.
+    "count" and "count_key" choose how to count the posts in page mode; check
+    out the "counts" module.
+    "rank" orders the posts by relevance first in page mode; since the cursors
+    are on (date_posted, id), cursor mode keeps listing them newest-first.
+    """
+    query: BaseQuery
+    user_data: dict = {}
+    sort_keys: tuple = POST_SORT_KEYS
+    count: Optional[str] = None  # Overrides the counting strategy of "paginate"
+    count_key: Optional[str] = None
+    rank: Optional[ColumnElement] = None
+
+
+def encode_cursor(item: Union[Post, Comment]) -> str:
+    """
+    Encodes the position of the given post or comment in its listing into an
+    opaque cursor.
+    :param item: Post or Comment
+    :return: str
+    """
+    raw = json.dumps([item.date_posted.isoformat(), item.id])
+    return base64.urlsafe_b64encode(raw.encode('utf-8')).decode('ascii')\
+        .rstrip('=')  # Drop the padding so that the cursor is URL-safe.
+
+
+def decode_cursor(cursor: str) -> Tuple[datetime, int]:
+    """
+    Decodes the given opaque cursor back into a (date_posted, id) position.
+    :param cursor: str
+    :return: tuple
+    :raises ValueError: if the cursor is malformed
+    """
+    padded = cursor + '=' * (-len(cursor) % 4)
+    try:
+        date_posted, id = json.loads(base64.urlsafe_b64decode(padded))
+        return datetime.fromisoformat(date_posted), int(id)
+    except (TypeError, ValueError) as e:
+        raise ValueError(f'Invalid cursor {cursor}') from e
+
+
+def paginate(collection_schema: Schema, max_per_page: int=10,
+             count: str=EXACT) -> Callable:
     """
     Pagination decorator, with the collections serialized using the given
     collection schema.
+    Two modes are supported:
+    1. Page mode (default), "?page=N", which uses OFFSET and reports the total
+       number of posts and pages, counted with the given strategy unless the
+       listing overrides it. "total_is_estimate" tells whether the total may be
+       approximate.
+    2. Cursor mode, "?after=<cursor>", which seeks directly to the position
+       after the given cursor on the (date_posted, id) index, so that its cost
+       does not depend on how deep the page is. An empty cursor starts from the
+       first page.
+    Both modes return a "next_cursor" in the pagination metadata, which is None
+    on the last page.
     :param collection_schema: Schema
     :param max_per_page: int
+    :param count: str
     :return: Callable
     """
     def decorated(f: Callable) -> Callable:
@@ -31,30 +103,141 @@ def paginate(collection_schema: Schema, max_per_page: int=10) -> Callable:
             per_page = min(
                 request.args.get('per_page', type=int, default=10), max_per_page
             )
+            after = request.args.get('after')
+            if page < 1 or per_page < 1:
+                return {
+                    'message': 'Invalid page or per_page'
+                }, 400
 
             result = f(*args, **kwargs)
             if isinstance(result, tuple):
-                query, user_data = result
+                listing = Listing(*result)
             else:
-                query, user_data = result, {}
-            p = query.order_by(Post.date_posted.desc()).paginate(page, per_page)
-            # "p" is a Pagination object.
+                listing = Listing(result)
+            sort_keys = listing.sort_keys
+            order_by = [key.desc() for key in sort_keys]
+            ranked = listing.rank is not None and after is None
+            if ranked:
+                order_by.insert(0, listing.rank.desc())
+            query = listing.query.order_by(*order_by)
+
+            if after is not None:  # Cursor mode
+                if after:
+                    try:
+                        position = decode_cursor(after)
+                    except ValueError as e:
+                        return {
+                            'message': str(e)
+                        }, 400
+                    query = query.filter(
+                        db.tuple_(*sort_keys) < db.tuple_(*position)
+                    )
+                # Fetch one extra post to know whether there is a next page,
+                # without counting the whole listing
+                items = query.limit(per_page + 1).all()
+                has_next = len(items) > per_page
+                items = items[:per_page]
+
+                # Populate the pagination metadata
+                pagination_meta = {
+                    'per_page': per_page,
+                    'next_cursor': next_cursor(items, has_next)
+                }
+            else:  # Page mode
+                items = query.offset((page - 1) * per_page)\
+                    .limit(per_page + 1)\
+                    .all()
+                has_next = len(items) > per_page
+                items = items[:per_page]
+
+                total, total_is_estimate = count_posts(
+                    listing.query, listing.count or count, listing.count_key
+                )
+                # Keep the total consistent with what this page has seen
+                if has_next:
+                    total = max(total, page * per_page + 1)
+                elif items or page == 1:
+                    total = (page - 1) * per_page + len(items)
 
-            # Populate the pagination metadata
-            pagination_meta = {
-                'page': page,
-                'pages': p.pages,
-                'total': p.total
-            }
+                # Populate the pagination metadata
+                pagination_meta = {
+                    'page': page,
+                    'pages': math.ceil(total / per_page),
+                    'total': total,
+                    'total_is_estimate': total_is_estimate,
+                    # A cursor can't continue a listing ordered by relevance.
+                    'next_cursor': next_cursor(items, has_next and not ranked)
+                }
 
             return {
                 'status': 'success',
                 'data': {
-                    'user_data': user_data,
-                    'posts': collection_schema.dump(p.items)
+                    'user_data': listing.user_data,
+                    'posts': collection_schema.dump(items)
                 },
                 'pagination_meta': pagination_meta
             }, 200
         return wrapper
 
     return decorated
+
+
+def next_cursor(items: list, has_next: bool) -> Optional[str]:
+    """
+    Gets the cursor pointing after the given page of posts or comments.
+    :param items: list[Post] or list[Comment]
+    :param has_next: bool
+    :return: str or None
+    """
+    if not has_next or not items:
+        return None
+    return encode_cursor(items[-1])
+
+
+def conditional(get_etag: Callable=None) -> Callable:
+    """
+    Conditional GET decorator, which tags the successful responses of the
+    decorated resource "get" method with a strong ETag, and answers
+    "If-None-Match" requests carrying the current ETag with 304.
+    If "get_etag" is given, it derives the ETag from the row versions before
+    running the decorated method, so that a 304 doesn't need any serialization;
+    it should return None if the resource doesn't exist. Otherwise the ETag is
+    a hash of the response body.
+    :param get_etag: Callable
+    :return: Callable
+    """
+    def decorated(f: Callable) -> Callable:
+
+        @functools.wraps(f)
+        def wrapper(*args, **kwargs):
+            etag = get_etag(*args, **kwargs) if get_etag else None
+            if etag and request.if_none_match.contains(etag):
+                return '', 304, {'ETag': f'"{etag}"'}
+
+            result = f(*args, **kwargs)
+            if isinstance(result, tuple):
+                body, status = result[0], result[1]
+            else:
+                body, status = result, 200
+            if status != 200:
+                return result
+
+            if not etag:
+                etag = make_etag(body)
+                if request.if_none_match.contains(etag):
+                    return '', 304, {'ETag': f'"{etag}"'}
+            return body, 200, {'ETag': f'"{etag}"'}
+        return wrapper
+
+    return decorated
+
+
+def make_etag(data: Union[dict, list, str]) -> str:
+    """
+    Makes a strong ETag from the given data.
+    :param data: dict or list or str
+    :return: str
+    """
+    if not isinstance(data, str):
+        data = json.dumps(data, sort_keys=True, default=str)
+    return hashlib.sha1(data.encode('utf-8')).hexdigest()
@@ -0,0 +1,128 @@
+# -*- coding: utf-8 -*-
+
+"""
+Login storm benchmark.
+
+Measures the latency of an unrelated, cheap "GET /users/<id>" while concurrent
+logins saturate a running user_service, to check that the password hashing
+doesn't freeze the other greenlets of the workers.
+
+Usage (against a running user_service, e.g., from inside the Docker network):
+    python -m benchmarks.login_benchmark --url http://user_service:8000 \
+        --logins 200 --concurrency 50
+"""
+
+from gevent import monkey
+monkey.patch_all()
+
+import argparse
+import statistics
+import time
+import uuid
+
+import gevent
+import requests
+from gevent.pool import Pool
+
+
+def create_user(url: str, password: str) -> dict:
+    """
+    Registers a throwaway benchmark user.
+    :param url: str
+    :param password: str
+    :return: dict
+    """
+    name = f'login-benchmark-{uuid.uuid4().hex[:12]}'
+    r = requests.post(f'{url}/users', json={
+        'username': name,
+        'email': f'{name}@example.com',
+        'password': password
+    })
+    r.raise_for_status()
+    return r.json()['data']
+
+
+def login(url: str, email: str, password: str) -> bool:
+    """
+    Logs in as the given user.
+    :param url: str
+    :param email: str
+    :param password: str
+    :return: bool, whether the login succeeded
+    """
+    r = requests.get(
+        f'{url}/user-auth', params={'email': email}, json={'password': password}
+    )
+    return r.status_code == 200
+
+
+def probe(url: str, user_id: int, duration: float) -> list:
+    """
+    Repeatedly gets the given user for the given duration.
+    :param url: str
+    :param user_id: int
+    :param duration: float
+    :return: list[float], the latencies in milliseconds
+    """
+    latencies = []
+    deadline = time.perf_counter() + duration
+    while time.perf_counter() < deadline:
+        start = time.perf_counter()
+        requests.get(f'{url}/users/{user_id}')
+        latencies.append((time.perf_counter() - start) * 1000)
+        gevent.sleep(0.05)
+    return latencies
+
+
+def report(label: str, latencies: list) -> None:
+    """
+    Prints the number, median and 99th percentile of the given latencies.
+    :param label: str
+    :param latencies: list[float], in milliseconds
+    :return: None
+    """
+    if not latencies:
+        print(f'{label:<20}{0:>8}')
+        return
+    latencies = sorted(latencies)
+    p99 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))]
+    print(
+        f'{label:<20}{len(latencies):>8}'
+        f'{statistics.median(latencies):>10.1f}{p99:>10.1f}'
+    )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--url', default='http://user_service:8000')
+    parser.add_argument('--logins', type=int, default=200)
+    parser.add_argument('--concurrency', type=int, default=50)
+    args = parser.parse_args()
+
+    password = uuid.uuid4().hex
+    user = create_user(args.url, password)
+
+    print(f'{"GET /users/<id>":<20}{"calls":>8}{"p50 ms":>10}{"p99 ms":>10}')
+    report('idle', probe(args.url, user['id'], 3))
+
+    pool = Pool(args.concurrency)
+    start = time.perf_counter()
+    storm = gevent.spawn(
+        pool.map, lambda _: login(args.url, user['email'], password),
+        range(args.logins)
+    )
+    gevent.sleep(0.5)  # Let the storm build up
+    latencies = []
+    while not storm.ready():
+        latencies.extend(probe(args.url, user['id'], 1))
+    elapsed = time.perf_counter() - start
+    report('during logins', latencies)
+    # Only the successful logins count, since a rejected one skips the hashing.
+    succeeded = sum(storm.value)
+    print(f'{succeeded} logins in {elapsed:.1f}s '
+          f'({succeeded / elapsed:.1f} logins/s), '
+          f'{args.logins - succeeded} failed')
+
+
+if __name__ == '__main__':
+    main()
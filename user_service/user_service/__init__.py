@@ -4,10 +4,12 @@ from flask_marshmallow import Marshmallow
 from flask_sqlalchemy import SQLAlchemy
 
 from .config import Config
+from .redis_ext import RedisStore
 
 db = SQLAlchemy()
 ma = Marshmallow()
 bcrypt = Bcrypt()
+redis_store = RedisStore()
 
 
 def create_app(config=Config) -> Flask:
@@ -21,10 +23,16 @@ def create_app(config=Config) -> Flask:
     db.init_app(app)
     ma.init_app(app)  # Order matters: Initialize SQLAlchemy before Marshmallow
     bcrypt.init_app(app)
+    from .passwords import password_hasher
+    password_hasher.init_app(app)
+    redis_store.init_app(app)
 
     from .api import api_bp
     app.register_blueprint(api_bp)
 
+    from .commands import repair_follow_counts_command
+    app.cli.add_command(repair_follow_counts_command)
+
     db.create_all(app=app)
 
     return app
@@ -7,15 +7,20 @@ API definition module.
 from flask import Blueprint
 from flask_restful import Api
 
-from .resources.user import UserAuth, UserItem, UserList, UserFollow
+from .representations import register_representations
+from .resources.user import OAuthUserList, UserAuth, UserFollowers, UserFollowing, UserItem, UserList, UserFollow
 
 # Create an API-related blueprint
 api_bp = Blueprint(name='api', import_name=__name__)
 
 api = Api(api_bp)
+register_representations(api)
 api.add_resource(UserList, '/users')
 api.add_resource(UserItem, '/users/<int:id>')
+api.add_resource(UserFollowers, '/users/<int:id>/followers')
+api.add_resource(UserFollowing, '/users/<int:id>/following')
 api.add_resource(UserAuth, '/user-auth')
+api.add_resource(OAuthUserList, '/oauth-users')
 api.add_resource(
     UserFollow, '/user-follow/<int:follower_id>/<followed_username>'
 )
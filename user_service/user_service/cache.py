@@ -0,0 +1,64 @@
+# -*- coding: utf-8 -*-
+
+"""
+post_service response cache invalidation module.
+"""
+
+from typing import Dict
+
+from flask import current_app
+from redis import RedisError
+
+from . import redis_store
+
+# The generation of post_service's response cache, which embeds the user data of
+# the authors; keep it in sync with post_service
+POST_CACHE_GENERATION_KEY = 'post_cache:generation'
+# The latest row version of a user, against which post_service checks the
+# versions of the users embedded in its cached responses; keep it in sync with
+# post_service
+POST_CACHE_USER_VERSION_KEY = 'post_cache:user_version:{}'
+
+# Only moves a user version forward, so that concurrent writes reporting their
+# versions out of order can't move it back
+_ADVANCE_VERSION_SCRIPT = """
+if tonumber(redis.call('GET', KEYS[1]) or '0') < tonumber(ARGV[1]) then
+    redis.call('SET', KEYS[1], ARGV[1])
+end
+"""
+
+
+def invalidate_post_cache() -> None:
+    """
+    Invalidates all the cached responses of post_service, after a change to the
+    user data embedded in them.
+    :return: None
+    """
+    try:
+        redis_store.incr(POST_CACHE_GENERATION_KEY)
+    except RedisError:
+        current_app.logger.exception("Failed to invalidate post_service's cache")
+
+
+def invalidate_post_cache_users(user_versions: Dict[int, int]) -> None:
+    """
+    Invalidates the cached responses of post_service embedding the given users,
+    after a change to their follow counts, by reporting their new row versions.
+    Unlike invalidate_post_cache(), the rest of the cached responses stay valid.
+    :param user_versions: dict{int: int}
+    :return: None
+    """
+    if not user_versions:
+        return
+    pipe = redis_store.pipeline(transaction=False)
+    for user_id, version in user_versions.items():
+        pipe.eval(
+            _ADVANCE_VERSION_SCRIPT,
+            1,
+            POST_CACHE_USER_VERSION_KEY.format(user_id),
+            version
+        )
+    try:
+        pipe.execute()
+    except RedisError:
+        current_app.logger.exception("Failed to invalidate post_service's cache")
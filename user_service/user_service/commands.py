@@ -0,0 +1,42 @@
+# -*- coding: utf-8 -*-
+
+"""
+Flask CLI commands module.
+"""
+
+import click
+from flask.cli import with_appcontext
+
+from . import db
+from .models import User, following
+
+
+@click.command('repair-follow-counts')
+@with_appcontext
+def repair_follow_counts_command() -> None:
+    """
+    Recomputes the denormalized follower and following counts of all the users
+    from the following relationships.
+    :return: None
+    """
+    users = User.__table__
+    follower_count = db.select([db.func.count()])\
+        .where(following.c.followed_id == users.c.id)\
+        .as_scalar()
+    following_count = db.select([db.func.count()])\
+        .where(following.c.follower_id == users.c.id)\
+        .as_scalar()
+    result = db.session.execute(
+        users.update()
+        .values(
+            follower_count=follower_count,
+            following_count=following_count,
+            version=users.c.version + 1
+        )
+        .where(
+            (users.c.follower_count != follower_count) |
+            (users.c.following_count != following_count)
+        )
+    )
+    db.session.commit()
+    click.echo(f'Repaired the follow counts of {result.rowcount} users.')
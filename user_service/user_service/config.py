@@ -22,3 +22,24 @@ class Config:
     postgres_db = 'flask_blog'
     SQLALCHEMY_DATABASE_URI = f'postgres://{postgres_user}:{postgres_password}@{postgres_hostname}/{postgres_db}'
     SQLALCHEMY_TRACK_MODIFICATIONS = False
+
+    # Redis, shared with post_service for its response cache
+    REDIS_URL = os.environ.get('REDIS_URL', 'redis://redis:6379/2')
+
+    # Maximum number of users fetched in one "GET /users?ids=" or
+    # "GET /users?usernames=" lookup
+    USERS_MAX_BATCH_SIZE = int(os.environ.get('USERS_MAX_BATCH_SIZE', 100))
+
+    # Default and maximum numbers of users per page of followers or following
+    FOLLOWS_PER_PAGE = int(os.environ.get('FOLLOWS_PER_PAGE', 20))
+    FOLLOWS_MAX_PER_PAGE = int(os.environ.get('FOLLOWS_MAX_PER_PAGE', 100))
+
+    # Number of the most recent posts of a newly followed user copied into the
+    # follower's home timeline
+    TIMELINE_BACKFILL_SIZE = int(os.environ.get('TIMELINE_BACKFILL_SIZE', 200))
+
+    # bcrypt cost factor (log2 of the rounds) of the new password hashes; the
+    # existing hashes are rehashed on the next successful login when it changes
+    BCRYPT_LOG_ROUNDS = int(os.environ.get('BCRYPT_LOG_ROUNDS', 12))
+    # Number of native threads per worker hashing the passwords
+    BCRYPT_POOL_SIZE = int(os.environ.get('BCRYPT_POOL_SIZE', 2))
@@ -5,8 +5,11 @@ Authentication-related models module.
 """
 
 from datetime import datetime
+from typing import Dict
 
+from flask import current_app
 from marshmallow import EXCLUDE, fields
+from sqlalchemy.dialects.postgresql import insert
 
 from . import db, ma
 
@@ -15,10 +18,83 @@ from . import db, ma
 
 # For the following system, check out
 # https://blog.miguelgrinberg.com/post/the-flask-mega-tutorial-part-viii-followers
+# The primary key makes following someone twice impossible. The two indices
+# back the newest-first (created_at, user ID) keyset pagination of whom a user
+# follows, and of who follows a user.
 following = db.Table(
     'following',
-    db.Column('follower_id', db.Integer, db.ForeignKey('users.id')),
-    db.Column('followed_id', db.Integer, db.ForeignKey('users.id'))
+    db.Column(
+        'follower_id',
+        db.Integer,
+        db.ForeignKey('users.id', ondelete='CASCADE'),
+        primary_key=True
+    ),
+    db.Column(
+        'followed_id',
+        db.Integer,
+        db.ForeignKey('users.id', ondelete='CASCADE'),
+        primary_key=True
+    ),
+    db.Column(
+        'created_at', db.DateTime, nullable=False, default=datetime.utcnow
+    ),
+    db.Index(
+        'ix_following_follower_id_created_at_followed_id',
+        'follower_id',
+        'created_at',
+        'followed_id'
+    ),
+    db.Index(
+        'ix_following_followed_id_created_at_follower_id',
+        'followed_id',
+        'created_at',
+        'follower_id'
+    )
+)
+
+
+# Materialized home timeline: one row per (reader, post), pushed when the post is
+# created (fan-out-on-write), so that reading the followed posts of a user is a
+# single range scan on (owner_id, date_posted, post_id).
+timeline = db.Table(
+    'timeline',
+    db.Column(
+        'owner_id',
+        db.Integer,
+        db.ForeignKey('users.id', ondelete='CASCADE'),
+        primary_key=True
+    ),
+    db.Column(
+        'post_id',
+        db.Integer,
+        db.ForeignKey('posts.id', ondelete='CASCADE'),
+        primary_key=True
+    ),
+    db.Column('author_id', db.Integer, nullable=False),
+    db.Column('date_posted', db.DateTime, nullable=False),
+    db.Index(
+        'ix_timeline_owner_id_date_posted_post_id',
+        'owner_id',
+        'date_posted',
+        'post_id'
+    ),
+    # Backs the cascading deletes of the entries of a deleted post, which
+    # would otherwise scan the whole table.
+    # On an existing database, create it with
+    # CREATE INDEX CONCURRENTLY ix_timeline_post_id ON timeline (post_id);
+    db.Index('ix_timeline_post_id', 'post_id')
+)
+
+
+# The batches of pending post likes already folded into "posts.likes", recorded
+# in the same transaction as the fold, so that a batch retried after a failed
+# hand-off in Redis is never applied twice
+like_flushes = db.Table(
+    'like_flushes',
+    db.Column('batch_id', db.String(32), primary_key=True),
+    db.Column(
+        'applied_at', db.DateTime, nullable=False, default=datetime.utcnow
+    )
 )
 
 
@@ -39,6 +115,19 @@ class User(db.Model):
 
     from_oauth = db.Column(db.Boolean, nullable=False, default=False)
     image_filename = db.Column(db.String(255), default='default.jpg')
+    # Denormalized counts of the following relationships, so that serializing a
+    # user doesn't need to count them
+    follower_count = db.Column(
+        db.Integer, nullable=False, default=0, server_default='0'
+    )
+    following_count = db.Column(
+        db.Integer, nullable=False, default=0, server_default='0'
+    )
+    # Row version, incremented on every update, from which the ETags are derived.
+    # Not an ORM version counter, since most updates are bulk statements bumping
+    # it themselves, which would make the concurrent ORM updates fail their
+    # version check; so the ORM updates bump it explicitly as well.
+    version = db.Column(db.Integer, nullable=False, server_default='1')
 
     posts = db.relationship(
         'Post', lazy='dynamic', cascade='all, delete-orphan', backref='author'
@@ -57,35 +146,120 @@ class User(db.Model):
         backref=db.backref('followers', lazy='dynamic'),
     )  # Both User.following and User.followers return a query.
 
-    def follow(self, user) -> None:
+    @classmethod
+    def follow(cls, follower_id: int, followed_id: int) -> Dict[int, int]:
         """
-        Follows the given user.
-        :param user: User
-        :return: None
+        Lets the given follower follow the given user, in a single statement
+        backed by the primary key of the following table, so that concurrent
+        follows can't create duplicate edges.
+        The follow counts and the home timeline are only updated if the edge is
+        new.
+        :param follower_id: int
+        :param followed_id: int
+        :return: dict{int: int}, the new row versions of both users, which is
+                 empty if the follower was already following the user
+        :raises IntegrityError: if either user doesn't exist
         """
-        if not self._is_following(user):
-            # User.following is a query.
-            self.following.append(user)
-
-    def _is_following(self, user) -> bool:
+        result = db.session.execute(
+            insert(following).values(
+                follower_id=follower_id, followed_id=followed_id
+            ).on_conflict_do_nothing()
+        )
+        if result.rowcount == 0:  # Already following
+            return {}
+        versions = cls._update_follow_counts(follower_id, followed_id, 1)
+        cls._backfill_timeline(follower_id, followed_id)
+        return versions
+
+    @classmethod
+    def unfollow(cls, follower_id: int, followed_id: int) -> Dict[int, int]:
         """
-        Private helper method to check whether this user is following the given
-        user.
-        :param: User
-        :return: bool
+        Lets the given follower unfollow the given user, in a single statement.
+        The follow counts and the home timeline are only updated if an edge was
+        actually removed.
+        :param follower_id: int
+        :param followed_id: int
+        :return: dict{int: int}, the new row versions of both users, which is
+                 empty if the follower wasn't following the user
         """
-        # User.following is a query.
-        return self.following.filter(following.c.followed_id == user.id).count() > 0
-
-    def unfollow(self, user) -> None:
+        result = db.session.execute(
+            following.delete().where(
+                (following.c.follower_id == follower_id) &
+                (following.c.followed_id == followed_id)
+            )
+        )
+        if result.rowcount == 0:  # Not following
+            return {}
+        versions = cls._update_follow_counts(follower_id, followed_id, -1)
+        cls._trim_timeline(follower_id, followed_id)
+        return versions
+
+    @classmethod
+    def _update_follow_counts(cls, follower_id: int, followed_id: int,
+                              delta: int) -> Dict[int, int]:
         """
-        Unfollows the given user.
-        :param user: User
+        Private helper method to atomically adjust the given follower's
+        following count and the given followed user's follower count by the
+        given delta, in a single statement.
+        :param follower_id: int
+        :param followed_id: int
+        :param delta: int
+        :return: dict{int: int}, the new row versions of both users
+        """
+        users = cls.__table__
+        rows = db.session.execute(
+            users.update()
+            .where(users.c.id.in_([follower_id, followed_id]))
+            .values(
+                following_count=users.c.following_count +
+                db.case([(users.c.id == follower_id, delta)], else_=0),
+                follower_count=users.c.follower_count +
+                db.case([(users.c.id == followed_id, delta)], else_=0),
+                version=users.c.version + 1
+            )
+            .returning(users.c.id, users.c.version)
+        )
+        return dict(rows.fetchall())
+
+    @staticmethod
+    def _backfill_timeline(owner_id: int, author_id: int) -> None:
+        """
+        Private helper method to copy the most recent posts of the given author
+        into the given user's home timeline.
+        :param owner_id: int
+        :param author_id: int
+        :return: None
+        """
+        recent_posts = db.select([
+            db.literal(owner_id, type_=db.Integer),
+            Post.id,
+            Post.user_id,
+            Post.date_posted
+        ]).where(Post.user_id == author_id)\
+            .order_by(Post.date_posted.desc())\
+            .limit(current_app.config['TIMELINE_BACKFILL_SIZE'])
+        db.session.execute(
+            insert(timeline).from_select(
+                ['owner_id', 'post_id', 'author_id', 'date_posted'],
+                recent_posts
+            ).on_conflict_do_nothing()
+        )
+
+    @staticmethod
+    def _trim_timeline(owner_id: int, author_id: int) -> None:
+        """
+        Private helper method to remove the posts of the given author from the
+        given user's home timeline.
+        :param owner_id: int
+        :param author_id: int
         :return: None
         """
-        if self._is_following(user):
-            # User.following is a query.
-            self.following.remove(user)
+        db.session.execute(
+            timeline.delete().where(
+                (timeline.c.owner_id == owner_id) &
+                (timeline.c.author_id == author_id)
+            )
+        )
 
 
 class Post(db.Model):
@@ -93,6 +267,10 @@ class Post(db.Model):
     Post table.
     """
     __tablename__ = 'posts'
+    __table_args__ = (
+        db.Index('ix_posts_date_posted_id', 'date_posted', 'id'),
+        db.Index('ix_posts_user_id_date_posted_id', 'user_id', 'date_posted', 'id'),
+    )  # Back the (date_posted, id) keyset pagination, globally and per author.
 
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(
@@ -106,9 +284,14 @@ class Post(db.Model):
         db.DateTime, nullable=False, default=datetime.utcnow
     )
     likes = db.Column(db.Integer, nullable=False, default=0)
+    # Row version, incremented on every update, from which the ETags are derived.
+    # Not an ORM version counter, since most updates are bulk statements bumping
+    # it themselves, which would make the concurrent ORM updates fail their
+    # version check; so the ORM updates bump it explicitly as well.
+    version = db.Column(db.Integer, nullable=False, server_default='1')
     comments = db.relationship(
-        'Comment', lazy=False, cascade='all, delete-orphan', backref='post'
-    )  # Post.comments is eager-loading.
+        'Comment', lazy=True, cascade='all, delete-orphan', backref='post'
+    )  # Post.comments is lazy-loading, so that listing posts doesn't load them.
 
 
 class Comment(db.Model):
@@ -116,6 +299,11 @@ class Comment(db.Model):
     Comment table.
     """
     __tablename__ = 'comments'
+    __table_args__ = (
+        db.Index(
+            'ix_comments_post_id_date_posted_id', 'post_id', 'date_posted', 'id'
+        ),
+    )  # Back the (date_posted, id) keyset pagination of the comments of a post.
 
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(
@@ -134,6 +322,17 @@ class Comment(db.Model):
     )
 
 
+# Full-text search document of a post, over its title and content.
+# PostgreSQL 9.6 doesn't support generated columns, so it's backed by a GIN
+# expression index instead, which the queries using the same expression hit.
+SEARCH_CONFIG = 'english'
+post_search_vector = db.func.to_tsvector(
+    db.literal_column(f"'{SEARCH_CONFIG}'"),
+    Post.title + db.literal_column("' '") + Post.content
+)
+db.Index('ix_posts_search_vector', post_search_vector, postgresql_using='gin')
+
+
 ##### SCHEMAS #####
 # Note!!!!!
 # The data validation is done in the upstream "flask_blog_app" on form level, so
@@ -152,38 +351,20 @@ class UserSchema(ma.Schema):
     password = fields.Str(required=True, load_only=True)
     from_oauth = fields.Boolean()
     image_filename = fields.Str()
-    following_count = fields.Method(
-        serialize='_get_following_count', dump_only=True
-    )
-    follower_count = fields.Method(
-        serialize='_get_follower_count', dump_only=True
-    )
-
-    def _get_following_count(self, obj: User) -> int:
-        """
-        Returns the number of following users of the given user.
-        :param obj: User
-        :return: int
-        """
-        if not obj:
-            return 0
-        return obj.following.count()  # User.following is a query.
-
-    def _get_follower_count(self, obj: User) -> int:
-        """
-        Returns the number of followers of the given user.
-        :param obj: User
-        :return: int
-        """
-        if not obj:
-            return 0
-        return obj.followers.count()  # User.following is a query.
+    following_count = fields.Int(dump_only=True)
+    follower_count = fields.Int(dump_only=True)
+    version = fields.Int(dump_only=True)
 
     class Meta:
         unknown = EXCLUDE
 
 
 user_schema = UserSchema()
+users_schema = UserSchema(many=True)
+# Compact user summaries, for the listings of followers and following
+user_summaries_schema = UserSchema(
+    many=True, only=('id', 'username', 'image_filename')
+)
 
 
 class PostSchema(ma.Schema):
@@ -0,0 +1,71 @@
+# -*- coding: utf-8 -*-
+
+"""
+Password hashing module.
+
+bcrypt is CPU-bound by design, and run on the event loop, it would freeze all
+the other greenlets of the gevent worker for the whole hashing. So the hashing
+and verification are run in a bounded pool of native threads instead, which
+bcrypt can use in parallel, since it releases the GIL while hashing; the
+calling greenlet just waits for the result, while the other greenlets keep
+running.
+"""
+
+from flask import Flask
+from gevent.threadpool import ThreadPool
+
+from . import bcrypt
+
+
+class PasswordHasher:
+    """
+    Password hasher running bcrypt in a bounded thread pool.
+    """
+
+    def __init__(self):
+        self._pool = None
+        self._log_rounds = None
+
+    def init_app(self, app: Flask) -> None:
+        """
+        Initializes the thread pool with the given application's
+        configuration.
+        :param app: Flask
+        :return: None
+        """
+        self._pool = ThreadPool(maxsize=app.config['BCRYPT_POOL_SIZE'])
+        self._log_rounds = app.config['BCRYPT_LOG_ROUNDS']
+
+    def hash(self, password: str) -> str:
+        """
+        Hashes the given password, with the configured cost.
+        :param password: str
+        :return: str
+        """
+        return self._pool.apply(
+            bcrypt.generate_password_hash, (password, self._log_rounds)
+        ).decode('utf-8')
+
+    def check(self, password_hash: str, password: str) -> bool:
+        """
+        Checks the given password against the given hash.
+        :param password_hash: str
+        :param password: str
+        :return: bool
+        """
+        return self._pool.apply(
+            bcrypt.check_password_hash, (password_hash, password)
+        )
+
+    def needs_rehash(self, password_hash: str) -> bool:
+        """
+        Checks whether the given hash was made with another cost than the
+        configured one.
+        :param password_hash: str
+        :return: bool
+        """
+        # "$2b$<log_rounds>$<salt and hash>"
+        return int(password_hash.split('$')[2]) != self._log_rounds
+
+
+password_hasher = PasswordHasher()
@@ -0,0 +1,32 @@
+# -*- coding: utf-8 -*-
+
+"""
+Redis client extension module.
+"""
+
+import redis
+from flask import Flask
+
+
+class RedisStore:
+    """
+    Minimal Flask extension holding a Redis client, configured from
+    "REDIS_URL" when the application is created.
+    """
+
+    def __init__(self):
+        self._client = None
+
+    def init_app(self, app: Flask) -> None:
+        """
+        Initializes the Redis client for the given application.
+        :param app: Flask
+        :return: None
+        """
+        self._client = redis.Redis.from_url(
+            app.config['REDIS_URL'], decode_responses=True
+        )
+
+    def __getattr__(self, name: str):
+        # Delegate everything else to the underlying Redis client
+        return getattr(self._client, name)
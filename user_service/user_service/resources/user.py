@@ -4,41 +4,187 @@
 User-related RESTful API module.
 """
 
-from typing import Tuple, Union
+from typing import Callable, Tuple, Union
 
-from flask import request
+from flask import current_app, request
 from flask_restful import Resource
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.exc import IntegrityError
 
-from .. import bcrypt, db
-from ..models import User, user_schema
+from .. import db
+from ..cache import invalidate_post_cache, invalidate_post_cache_users
+from ..models import User, following, user_schema, user_summaries_schema, users_schema
+from ..passwords import password_hasher
+from ..utils import decode_cursor, encode_cursor, make_etag
 
+# Stored as the password of the OAuth users, which is not a valid bcrypt hash,
+# so that no password can ever match it
+OAUTH_PASSWORD = '!'
 
-def _repeat_username(username: str) -> Union[Tuple, bool]:
+
+def _get_users(key: str, values: list):
+    """
+    Private helper function to get the users whose given key ("id" or
+    "username") is among the given values, in a single query and a single
+    serialization pass, in the order of the given values.
+    The values matching no user are skipped.
+    :param key: str
+    :param values: list
+    :return:
+    """
+    max_batch_size = current_app.config['USERS_MAX_BATCH_SIZE']
+    if len(values) > max_batch_size:
+        return {
+            'message': f'At most {max_batch_size} users can be fetched at once'
+        }, 400
+    column = getattr(User, key)
+    # The follow counts are columns, so this is the only query.
+    users = User.query.filter(column.in_(values)).all() if values else []
+    users_by_key = {getattr(user, key): user for user in users}
+    found = [users_by_key[value] for value in values if value in users_by_key]
+    return {
+        'status': 'success',
+        'data': users_schema.dump(found)
+    }
+
+
+def _parse_list_arg(name: str, convert: Callable=str) -> list:
+    """
+    Private helper function to parse the given comma-separated query argument,
+    dropping the empty and repeated values.
+    :param name: str
+    :param convert: Callable, converting each value
+    :return: list
+    :raises ValueError: if a value can't be converted
+    """
+    values = (value.strip() for value in request.args[name].split(','))
+    # dict keeps the first occurrences in order.
+    return list(dict.fromkeys(convert(value) for value in values if value))
+
+
+def _get_follow_page(user_id: int, followers: bool):
     """
-    Private helper function to check whether the given username is repeated.
+    Private helper function to get a page of the followers of the given user,
+    or of the users that the given user follows, newest-first, paginated by
+    "?after=<cursor>&limit=".
+    The page seeks directly to the cursor position on the (user ID,
+    created_at, other user ID) index of the following table, so that its cost
+    doesn't depend on how deep the page is.
+    :param user_id: int
+    :param followers: bool, whether to list the followers
+    :return:
+    """
+    if db.session.query(User.id).filter_by(id=user_id).scalar() is None:
+        return {
+            'message': f'No user with ID {user_id}'
+        }, 404
+
+    limit = min(
+        request.args.get(
+            'limit', type=int, default=current_app.config['FOLLOWS_PER_PAGE']
+        ),
+        current_app.config['FOLLOWS_MAX_PER_PAGE']
+    )
+    if limit < 1:
+        return {
+            'message': 'Invalid limit'
+        }, 400
+
+    if followers:
+        own_id, other_id = following.c.followed_id, following.c.follower_id
+    else:
+        own_id, other_id = following.c.follower_id, following.c.followed_id
+    query = db.session.query(User, following.c.created_at)\
+        .join(following, (User.id == other_id))\
+        .filter(own_id == user_id)
+    after = request.args.get('after')
+    if after:
+        try:
+            position = decode_cursor(after)
+        except ValueError as e:
+            return {
+                'message': str(e)
+            }, 400
+        query = query.filter(
+            db.tuple_(following.c.created_at, other_id) < db.tuple_(*position)
+        )
+    # Fetch one extra edge to know whether there is a next page, without
+    # counting them
+    rows = query.order_by(following.c.created_at.desc(), other_id.desc())\
+        .limit(limit + 1)\
+        .all()
+    has_next = len(rows) > limit
+    rows = rows[:limit]
+
+    next_cursor = None
+    if has_next:
+        last_user, last_created_at = rows[-1]
+        next_cursor = encode_cursor(last_created_at, last_user.id)
+    return {
+        'status': 'success',
+        'data': user_summaries_schema.dump([user for user, _ in rows]),
+        'pagination_meta': {
+            'limit': limit,
+            'next_cursor': next_cursor
+        }
+    }
+
+
+def _taken_check(username: str=None, email: str=None) -> Union[Tuple, bool]:
+    """
+    Private helper function to check whether the given username or email is
+    taken by another user, in a single query, reporting the error of each field.
+    Only run when "?validate=true" is given, for the clients which want the
+    field-level errors before writing; otherwise the unique constraints catch
+    the repeats on write.
     :param username: str
+    :param email: str
     :return:
     """
-    user = User.query.filter_by(username=username).first()
-    if user:
+    conditions = []
+    if username is not None:
+        conditions.append(User.username == username)
+    if email is not None:
+        conditions.append(User.email == email)
+    if not conditions:
+        return False
+    rows = db.session.query(User.username, User.email)\
+        .filter(db.or_(*conditions))\
+        .limit(2)\
+        .all()
+    errors = {}
+    for taken_username, taken_email in rows:
+        if username is not None and taken_username == username:
+            errors['username'] = 'This username has been taken.'
+        if email is not None and taken_email == email:
+            errors['email'] = 'This email has been taken.'
+    if errors:
         return {
-            'message': 'This username has been taken.'
+            'message': errors.get('username') or errors['email'],
+            'errors': errors
         }, 400
     return False
 
 
-def _repeat_email(email: str) -> Union[Tuple, bool]:
+def _taken_error(e: IntegrityError) -> Tuple:
     """
-    Private helper function to check whether the given email is repeated.
-    :param email: str
+    Private helper function to translate the given unique constraint violation
+    on the username or email into the corresponding error.
+    :param e: IntegrityError
     :return:
+    :raises IntegrityError: if it's not a violation on the username or email
     """
-    user = User.query.filter_by(email=email).first()
-    if user:
+    diag = getattr(e.orig, 'diag', None)
+    constraint = getattr(diag, 'constraint_name', None) or str(e.orig)
+    if 'username' in constraint:
+        return {
+            'message': 'This username has been taken.'
+        }, 400
+    if 'email' in constraint:
         return {
             'message': 'This email has been taken.'
         }, 400
-    return False
+    raise e
 
 
 class UserList(Resource):
@@ -48,14 +194,27 @@ class UserList(Resource):
 
     def get(self):
         """
-        Returns a user with a specified username or email.
+        Returns a user with a specified username or email, or the users with
+        the comma-separated "?ids=" or "?usernames=".
         :return:
         """
+        if 'ids' in request.args:
+            try:
+                ids = _parse_list_arg('ids', int)
+            except ValueError:
+                return {
+                    'message': 'Invalid user IDs'
+                }, 400
+            return _get_users('id', ids)
+        if 'usernames' in request.args:
+            return _get_users('username', _parse_list_arg('usernames'))
+
         username = request.args.get('username')
         email = request.args.get('email')
         if not username and not email:
             return {
-                'message': 'Username or email argument not provided'
+                'message': 'Username, email, IDs or usernames argument not '
+                           'provided'
             }, 400
 
         if username:
@@ -77,7 +236,10 @@ class UserList(Resource):
 
     def post(self):
         """
-        Adds a new user.
+        Adds a new user, in a single write statement; a taken username or email
+        is caught by the unique constraints.
+        With "?validate=true", both are checked beforehand, so that all the
+        field-level errors are reported.
         :return:
         """
         user_data = request.json
@@ -85,29 +247,82 @@ class UserList(Resource):
         email = user_data['email']
         password = user_data['password']
 
-        repeat_username_check = _repeat_username(username)
-        if repeat_username_check:
-            return repeat_username_check
-        repeat_email_check = _repeat_email(email)
-        if repeat_email_check:
-            return repeat_email_check
+        if request.args.get('validate') == 'true':
+            taken_check = _taken_check(username, email)
+            if taken_check:
+                return taken_check
 
         new_user = User(
             username=username,
             email=email,
-            password=bcrypt.generate_password_hash(password).decode('utf-8')
+            password=password_hasher.hash(password)
         )
         if 'from_oauth' in user_data:
             new_user.from_oauth = True
             new_user.image_filename = user_data['image_url']
         db.session.add(new_user)
-        db.session.commit()
+        try:
+            db.session.commit()
+        except IntegrityError as e:
+            db.session.rollback()
+            return _taken_error(e)
         return {
             'status': 'success',
             'data': user_schema.dump(new_user)
         }, 201
 
 
+class OAuthUserList(Resource):
+    """
+    Resource for a collection of OAuth users.
+    """
+
+    def post(self):
+        """
+        Adds the given OAuth user if not existing yet, and returns it, in a
+        single statement.
+        Since OAuth users log in through their OAuth provider, no password is
+        involved, and thus no password hashing.
+        :return:
+        """
+        user_data = request.json
+        users = User.__table__
+        stmt = insert(users).values(
+            username=user_data['username'],
+            email=user_data['email'],
+            password=OAUTH_PASSWORD,
+            from_oauth=True,
+            image_filename=user_data['image_url']
+        )
+        # Only matches an existing OAuth user; the no-op update is there so
+        # that the existing row is returned as well.
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[users.c.email],
+            set_={'email': stmt.excluded.email},
+            where=users.c.from_oauth
+        ).returning(
+            *users.c,
+            db.literal_column('xmax = 0').label('inserted')
+        )
+        try:
+            row = db.session.execute(stmt).first()
+        except IntegrityError:  # The username is taken by another user.
+            db.session.rollback()
+            return {
+                'message': 'This username has been taken.'
+            }, 400
+        if row is None:  # The email is taken by a non-OAuth user.
+            db.session.rollback()
+            return {
+                'message': 'This email has been taken.'
+            }, 400
+        db.session.commit()
+        return {
+            'status': 'success',
+            'data': user_schema.dump(row)
+        }, 201 if row.inserted else 200
+
+
 class UserItem(Resource):
     """
     Resource for a single user.
@@ -120,39 +335,93 @@ class UserItem(Resource):
         :return:
         """
         user = User.query.get(id)
+        if not user:
+            return {
+                'message': f'No user with ID {id}'
+            }, 404
+
+        # Conditional GET, with the ETag derived from the row version
+        etag = make_etag(f'{user.id}:{user.version}')
+        if request.if_none_match.contains(etag):
+            return '', 304, {'ETag': f'"{etag}"'}
         return {
             'status': 'success',
             'data': user_schema.dump(user)
-        }
+        }, 200, {'ETag': f'"{etag}"'}
 
     def put(self, id: int):
         """
-        Updates the user with the given ID.
+        Updates the user with the given ID; a taken username or email is caught
+        by the unique constraints.
+        With "?validate=true", both are checked beforehand, so that all the
+        field-level errors are reported.
         :param id: int
         :return:
         """
         user = User.query.get(id)
+        if not user:
+            return {
+                'message': f'No user with ID {id}'
+            }, 404
 
         update = request.json
+        if request.args.get('validate') == 'true':
+            taken_check = _taken_check(
+                update.get('username'), update.get('email')
+            )
+            if taken_check:
+                return taken_check
+
         if 'username' in update:
-            repeat_username_check = _repeat_username(update['username'])
-            if repeat_username_check:
-                return repeat_username_check
             user.username = update['username']
         if 'email' in update:
-            repeat_email_check = _repeat_email(update['email'])
-            if repeat_email_check:
-                return repeat_email_check
             user.email = update['email']
         if 'image_filename' in update:
             user.image_filename = update['image_filename']
-        db.session.commit()
+        # Bumped in the UPDATE itself, so that it composes with the concurrent
+        # bulk updates of the follow counts
+        user.version = User.version + 1
+        try:
+            db.session.commit()
+        except IntegrityError as e:
+            db.session.rollback()
+            return _taken_error(e)
+        invalidate_post_cache()
         return {
             'status': 'success',
             'data': user_schema.dump(user)
         }
 
 
+class UserFollowers(Resource):
+    """
+    Resource for the followers of a user.
+    """
+
+    def get(self, id: int):
+        """
+        Returns the followers of the user with the given ID, newest-first.
+        :param id: int
+        :return:
+        """
+        return _get_follow_page(id, followers=True)
+
+
+class UserFollowing(Resource):
+    """
+    Resource for the users that a user follows.
+    """
+
+    def get(self, id: int):
+        """
+        Returns the users that the user with the given ID follows,
+        newest-first.
+        :param id: int
+        :return:
+        """
+        return _get_follow_page(id, followers=False)
+
+
 class UserAuth(Resource):
     """
     Resource for user authentication.
@@ -170,13 +439,26 @@ class UserAuth(Resource):
                 'message': f'No user with email {email}'
             }, 404
 
-        if not bcrypt.check_password_hash(
-            user.password, request.json['password']
-        ):
+        if user.from_oauth:
+            return {
+                'message': 'OAuth users should log in through their OAuth '
+                           'provider.'
+            }, 401
+        password = request.json['password']
+        if not password_hasher.check(user.password, password):
             return {
                 'message': 'Login unsuccessful. Please check your email and '
                            'password.'
             }, 401
+        if password_hasher.needs_rehash(user.password):
+            # Upgrade the hash to the configured cost, now that we know the
+            # password. Not a change of the user data, so the row version
+            # isn't bumped.
+            User.query.filter_by(id=user.id).update(
+                {User.password: password_hasher.hash(password)},
+                synchronize_session=False
+            )
+            db.session.commit()
         return {
             'status': 'success',
             'data': user_schema.dump(user)
@@ -205,9 +487,16 @@ class UserFollow(Resource):
                 'message': 'You cannot follow yourself.'
             }, 400
 
-        follower = User.query.get(follower_id)
-        follower.follow(followed)
+        try:
+            versions = User.follow(follower_id, followed.id)
+        except IntegrityError:  # The follower doesn't exist.
+            db.session.rollback()
+            return {
+                'message': f'No user with ID {follower_id}'
+            }, 404
         db.session.commit()
+        # The follow counts of both users and the follower's timeline changed.
+        invalidate_post_cache_users(versions)
         return {
             'status': 'success',
             'data': user_schema.dump(followed)
@@ -215,7 +504,8 @@ class UserFollow(Resource):
 
     def delete(self, follower_id: int, followed_username: str):
         """
-        Lets the given follower unfollows the user with the given username.
+        Lets the given follower unfollow the user with the given username, and
+        returns that user.
         :param follower_id: int
         :param followed_username: str
         :return:
@@ -230,7 +520,11 @@ class UserFollow(Resource):
                 'message': 'You cannot unfollow yourself.'
             }, 400
 
-        follower = User.query.get(follower_id)
-        follower.unfollow(followed)
+        versions = User.unfollow(follower_id, followed.id)
         db.session.commit()
-        return {}, 204
+        # The follow counts of both users and the follower's timeline changed.
+        invalidate_post_cache_users(versions)
+        return {
+            'status': 'success',
+            'data': user_schema.dump(followed)
+        }
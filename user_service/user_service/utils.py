@@ -0,0 +1,48 @@
+# -*- coding: utf-8 -*-
+
+"""
+Utility functions.
+"""
+
+import base64
+import hashlib
+import json
+from datetime import datetime
+from typing import Tuple
+
+
+def make_etag(data: str) -> str:
+    """
+    Makes a strong ETag from the given data.
+    :param data: str
+    :return: str
+    """
+    return hashlib.sha1(data.encode('utf-8')).hexdigest()
+
+
+def encode_cursor(created_at: datetime, id: int) -> str:
+    """
+    Encodes the given (created_at, id) position in a listing into an opaque
+    cursor.
+    :param created_at: datetime
+    :param id: int
+    :return: str
+    """
+    raw = json.dumps([created_at.isoformat(), id])
+    return base64.urlsafe_b64encode(raw.encode('utf-8')).decode('ascii')\
+        .rstrip('=')  # Drop the padding so that the cursor is URL-safe.
+
+
+def decode_cursor(cursor: str) -> Tuple[datetime, int]:
+    """
+    Decodes the given opaque cursor back into a (created_at, id) position.
+    :param cursor: str
+    :return: tuple
+    :raises ValueError: if the cursor is malformed
+    """
+    padded = cursor + '=' * (-len(cursor) % 4)
+    try:
+        created_at, id = json.loads(base64.urlsafe_b64decode(padded))
+        return datetime.fromisoformat(created_at), int(id)
+    except (TypeError, ValueError) as e:
+        raise ValueError(f'Invalid cursor {cursor}') from e